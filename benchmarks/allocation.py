@@ -0,0 +1,66 @@
+"""
+Benchmark of drawing simulated randomisations with allocation.allocate
+against the per-randomisation pandas groupby it replaced. Run with
+`just bench allocation`.
+"""
+
+import random
+import timeit
+
+import numpy
+import pandas
+
+from retractions import allocation
+
+
+def pandas_randomise(df, stratifying_name="groups"):
+    groups = df.groupby(stratifying_name)
+    intervention = []
+    control = []
+    for group_name, group_data in groups:
+        group_data["random"] = numpy.random.random(len(group_data))
+        group_data = group_data.sort_values(by="random")
+        pmids = list(group_data.pmid)
+        total = len(pmids)
+        intervention += pmids[0 : total // 2]
+        control += pmids[-(total // -2) :]
+        middle = pmids[(total // 2) : -(total // -2)]
+        if random.randint(0, 1):
+            intervention += middle
+        else:
+            control += middle
+    return pandas.concat(
+        [
+            pandas.Series("i", index=intervention),
+            pandas.Series("c", index=control),
+        ]
+    )
+
+
+def main(papers=5000, strata=9):
+    seed_sequence = numpy.random.SeedSequence()
+    rng = numpy.random.default_rng(seed_sequence)
+    df = pandas.DataFrame(
+        {
+            "pmid": numpy.arange(papers).astype(str),
+            "groups": rng.integers(0, strata, papers),
+        }
+    )
+    print(f"{papers} papers in {strata} strata")
+    for count in [500, 10000]:
+        if count <= 500:
+            seconds = timeit.timeit(
+                lambda: [pandas_randomise(df) for _ in range(count)], number=1
+            )
+            print(f"  pandas groupby, {count:>5} randomisations {seconds:8.2f} s")
+        seconds = timeit.timeit(
+            lambda: allocation.allocate(
+                df.groups.to_numpy(), allocation.generators(seed_sequence, count)
+            ),
+            number=1,
+        )
+        print(f"  allocation.allocate, {count:>5} randomisations {seconds:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
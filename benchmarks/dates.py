@@ -0,0 +1,59 @@
+"""
+Micro-benchmark of Scopus date-text parsing against the strptime cascade
+it replaced. Run with `just bench dates`.
+"""
+
+import datetime
+import timeit
+
+from retractions import dates
+
+
+samples = [
+    "22 September 1983",
+    "September 1983",
+    "1983",
+    "September 22, 1983",
+    "Sep-1983",
+    "Sept 1983",
+]
+
+
+def strptime_text_date(t):
+    try:
+        return datetime.datetime.strptime(t, "%d %B %Y").date()
+    except ValueError:
+        try:
+            return datetime.datetime.strptime(t, "%B %Y").date()
+        except ValueError:
+            try:
+                return datetime.datetime.strptime(t, "%Y").date()
+            except ValueError:
+                try:
+                    return datetime.datetime.strptime(t, "%B %d, %Y").date()
+                except ValueError:
+                    try:
+                        return datetime.datetime.strptime(t, "%b-%Y").date()
+                    except ValueError:
+                        return None
+
+
+def uncached_text_date(t):
+    dates._parse_text_date.cache_clear()
+    return dates.parse_text_date(t)
+
+
+def main(number=20000):
+    for name, parse in [
+        ("strptime cascade", strptime_text_date),
+        ("dates.parse_text_date, uncached", uncached_text_date),
+        ("dates.parse_text_date, cached", dates.parse_text_date),
+    ]:
+        print(name)
+        for s in samples:
+            seconds = timeit.timeit(lambda: parse(s), number=number)
+            print(f"  {s!r:<24} {seconds / number * 1e6:8.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
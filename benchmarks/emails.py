@@ -0,0 +1,78 @@
+"""
+Micro-benchmark of rendering a retraction alert mail from the HTML and plain
+text templates, against deriving the plain text from the HTML with html2text
+as before. Run with `just bench emails`.
+"""
+
+import datetime
+import os
+import timeit
+
+import django
+import html2text
+
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "retractobot.settings")
+django.setup()
+
+from django.template.loader import render_to_string  # noqa: E402
+
+from retractions import emails  # noqa: E402
+from retractions.models import (  # noqa: E402
+    CitingPaper,
+    RetractedPaper,
+    RetractionNotice,
+)
+
+
+def mail_context(citing_papers, retracted_papers):
+    citations = []
+    for i in range(citing_papers):
+        citing_paper = CitingPaper(
+            scopus_id=str(500000 + i),
+            title=f"Empagliflozin limits Tofu eating, part {i}",
+            journalname="Frontiers in Tofu",
+            comparisondate=datetime.date(2017, 1, 1),
+        )
+        retractions = []
+        for j in range(retracted_papers):
+            retracted_paper = RetractedPaper(
+                pmid=str(4000 + j),
+                title="Tofu eating in children: a prospective randomized study.",
+                journal_iso="J. Tofu.",
+                comparisondate=datetime.date(1999, 1, 1),
+            )
+            notice = RetractionNotice(
+                pmid=str(3900000 + j), comparisondate=datetime.date(2000, 1, 1)
+            )
+            retractions.append((retracted_paper, notice))
+        citations.append((citing_paper, retractions))
+    return {
+        "name": "Victor S. Tofu",
+        "recentest_citing_paper": citations[0][0],
+        "citations": citations,
+        "several_papers": retracted_papers > 1,
+    }
+
+
+def html2text_render(context):
+    text_maker = html2text.HTML2Text()
+    text_maker.links_each_paragraph = True
+    body_html = render_to_string("retractions/retraction_email.html", context)
+    return (body_html, text_maker.handle(body_html).strip())
+
+
+def main(number=1000):
+    for citing_papers, retracted_papers in [(1, 1), (3, 2), (10, 3)]:
+        context = mail_context(citing_papers, retracted_papers)
+        print(f"{citing_papers} citing papers, {retracted_papers} retracted papers")
+        for name, render in [
+            ("html template + html2text", html2text_render),
+            ("html and text templates", emails.render),
+        ]:
+            seconds = timeit.timeit(lambda: render(context), number=number)
+            print(f"  {name:<26} {seconds / number * 1e6:8.1f} µs per message")
+
+
+if __name__ == "__main__":
+    main()
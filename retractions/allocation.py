@@ -0,0 +1,127 @@
+"""
+Stratified allocation of retracted papers to the intervention and control
+groups.
+
+Each stratum is shuffled and split in half, with a coin toss for the middle
+paper when a stratum has an odd number of papers, so the groups differ in
+size by at most the number of strata. Each randomisation draws from its own
+numpy Generator, typically spawned from a SeedSequence, so any one of them
+can be reproduced from the seed and its index, and randomisations can be
+split across processes without sharing random state. Randomisations are then
+sorted together a stratum at a time, which is what makes thousands of
+simulations cheap.
+"""
+
+import multiprocessing
+
+import numpy
+
+
+INTERVENTION = 1
+CONTROL = 0
+
+
+def generators(seed_sequence, count):
+    """
+    Independent Generators for count randomisations, spawned from
+    seed_sequence
+    """
+    return [numpy.random.default_rng(s) for s in seed_sequence.spawn(count)]
+
+
+def allocate_parallel(strata, seed_sequence, count, workers=1, chunk_size=500):
+    """
+    allocate() count randomisations with Generators spawned from
+    seed_sequence, split into chunks of randomisations across workers
+    processes. The result is the same whatever the number of workers, as
+    long as seed_sequence hasn't spawned any children before.
+    """
+    if workers == 1:
+        return allocate(strata, generators(seed_sequence, count), chunk_size)
+
+    ranges = [
+        (start, min(start + chunk_size, count)) for start in range(0, count, chunk_size)
+    ]
+    with multiprocessing.Pool(
+        workers,
+        initializer=_init_worker,
+        initargs=(numpy.asarray(strata), seed_sequence),
+    ) as pool:
+        return numpy.concatenate(pool.map(_allocate_range, ranges))
+
+
+# Set in each worker process by _init_worker, so the strata are sent to each
+# worker once rather than with every chunk
+_worker_strata = None
+_worker_seed_sequence = None
+
+
+def _init_worker(strata, seed_sequence):
+    global _worker_strata, _worker_seed_sequence
+    _worker_strata = strata
+    _worker_seed_sequence = seed_sequence
+
+
+def _allocate_range(start_stop):
+    # Rebuild the Generators seed_sequence.spawn() would give randomisations
+    # start to stop
+    start, stop = start_stop
+    rngs = [
+        numpy.random.default_rng(
+            numpy.random.SeedSequence(
+                _worker_seed_sequence.entropy,
+                spawn_key=_worker_seed_sequence.spawn_key + (i,),
+                pool_size=_worker_seed_sequence.pool_size,
+            )
+        )
+        for i in range(start, stop)
+    ]
+    return _allocate_chunk(_worker_strata, rngs)
+
+
+def allocate(strata, rngs, chunk_size=500):
+    """
+    Randomise the papers with the given strata once for each numpy Generator
+    in rngs. Returns a (len(rngs) x papers) int8 matrix of INTERVENTION and
+    CONTROL. Randomisations are drawn chunk_size at a time to bound memory.
+    """
+    strata = numpy.asarray(strata)
+    allocations = numpy.empty((len(rngs), len(strata)), dtype=numpy.int8)
+    for start in range(0, len(rngs), chunk_size):
+        chunk = rngs[start : start + chunk_size]
+        allocations[start : start + len(chunk)] = _allocate_chunk(strata, chunk)
+    return allocations
+
+
+def _allocate_chunk(strata, rngs):
+    stratum_values, stratum_indexes = numpy.unique(strata, return_inverse=True)
+    count = len(rngs)
+    # Draw every random number a randomisation needs from its own Generator:
+    # a sort key per paper, and a coin per stratum for the middle paper
+    keys = numpy.empty((count, len(strata)))
+    coins = numpy.empty((count, len(stratum_values)), dtype=numpy.int8)
+    for row, rng in enumerate(rngs):
+        keys[row] = rng.random(len(strata))
+        coins[row] = rng.integers(0, 2, size=len(stratum_values), dtype=numpy.int8)
+
+    allocations = numpy.empty((count, len(strata)), dtype=numpy.int8)
+    for index in range(len(stratum_values)):
+        (papers,) = numpy.nonzero(stratum_indexes == index)
+        total = len(papers)
+        # Position of each paper in every shuffle of the stratum
+        order = keys[:, papers].argsort(axis=1)
+        by_position = numpy.full(total, CONTROL, dtype=numpy.int8)
+        by_position[: total // 2] = INTERVENTION
+        stratum_allocations = numpy.empty((count, total), dtype=numpy.int8)
+        numpy.put_along_axis(
+            stratum_allocations,
+            order,
+            numpy.broadcast_to(by_position, (count, total)),
+            axis=1,
+        )
+        # Randomly assign middle value if there are an odd number of values
+        if total % 2:
+            middle = order[:, total // 2]
+            stratum_allocations[numpy.arange(count), middle] = coins[:, index]
+        allocations[:, papers] = stratum_allocations
+    return allocations
@@ -0,0 +1,80 @@
+"""
+Build the randomisation and analysis datasets from querysets, and write
+them out.
+
+Query results are streamed from a server-side cursor into Arrow record
+batches a chunk at a time, so building a dataset never holds the rows as
+Python dicts as well as the columns.
+"""
+
+import itertools
+
+import numpy
+import pyarrow
+import pyarrow.feather
+import pyarrow.parquet
+
+from retractions import allocation
+
+
+# Output formats for datasets; parquet and arrow are typed and compressed
+FORMATS = ["csv", "parquet", "arrow"]
+
+
+def values_table(queryset, *fields, chunk_size=10000):
+    """
+    Stream the values of fields from queryset into an Arrow table
+    """
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    tables = []
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        tables.append(
+            pyarrow.table(
+                {
+                    field: pyarrow.array(column)
+                    for field, column in zip(fields, zip(*chunk))
+                }
+            )
+        )
+    if not tables:
+        return pyarrow.table({field: pyarrow.array([]) for field in fields})
+    # Columns which are all null in a chunk are promoted to the type of the
+    # other chunks
+    return pyarrow.concat_tables(tables, promote_options="default")
+
+
+def values_frame(queryset, *fields, chunk_size=10000):
+    """
+    Stream the values of fields from queryset into a pandas DataFrame, in
+    place of pandas.DataFrame(queryset.values(*fields))
+    """
+    table = values_table(queryset, *fields, chunk_size=chunk_size)
+    # Free each Arrow column as it is converted
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def write_dataset(df, path, file_format, treatment):
+    """
+    Write df, indexed by pmid, in file_format. treatment columns hold
+    allocation codes, written as "i"/"c" in csv and as int8 otherwise.
+    Columnar formats dictionary encode the pmids and are compressed.
+    """
+    if file_format == "csv":
+        df = df.copy()
+        df[treatment] = numpy.where(df[treatment] == allocation.INTERVENTION, "i", "c")
+        df.to_csv(path)
+        return
+
+    df = df.astype({column: numpy.int8 for column in treatment})
+    table = pyarrow.Table.from_pandas(df, preserve_index=True)
+    table = table.set_column(
+        table.schema.get_field_index("pmid"),
+        "pmid",
+        table.column("pmid").dictionary_encode(),
+    )
+    if file_format == "parquet":
+        pyarrow.parquet.write_table(table, path, compression="zstd")
+    elif file_format == "arrow":
+        pyarrow.feather.write_feather(table, path, compression="zstd")
+    else:
+        raise ValueError(f"Unknown format {file_format}")
@@ -0,0 +1,171 @@
+"""
+Parse the free text dates found in PubMed and Scopus records.
+
+Patterns are compiled once and dispatched in order, months are looked up in
+English tables rather than via the locale dependent strptime, and results are
+cached as the same few strings turn up again and again. Like
+pubmed.get_pubmed_date_from_node, each parser returns the date along with its
+granularity.
+"""
+
+import datetime
+import functools
+import re
+
+
+month_mapper = {
+    "Jan": 1,
+    "Feb": 2,
+    "Mar": 3,
+    "Apr": 4,
+    "May": 5,
+    "Jun": 6,
+    "Jul": 7,
+    "Aug": 8,
+    "Sep": 9,
+    "Oct": 10,
+    "Nov": 11,
+    "Dec": 12,
+}
+
+season_mapper = {
+    "Summer": 7,
+    "Spring": 4,
+    "Winter": 1,
+    "Fall": 10,
+}
+
+# Case insensitive lookups for Scopus text dates, which match what
+# strptime's %B and %b accept in the C locale
+month_names = {
+    "january": 1,
+    "february": 2,
+    "march": 3,
+    "april": 4,
+    "may": 5,
+    "june": 6,
+    "july": 7,
+    "august": 8,
+    "september": 9,
+    "october": 10,
+    "november": 11,
+    "december": 12,
+}
+month_abbreviations = {name.lower(): month for name, month in month_mapper.items()}
+
+medline_subpatterns = {
+    "year": r"\d{4}",
+    "month": r"\w{3}",
+    "day": r"\d{1,2}",
+    "season": r"\w{4,6}",
+    "sep": " *[-/] *",
+}
+
+medline_patterns = [
+    re.compile(pattern.format(**medline_subpatterns) + "$")
+    for pattern in [
+        # eg "1983 Sep 22-28"
+        "({year}) ({month}) ({day}){sep}{day}",
+        # eg "2007 Aug 9-Sep 12",
+        "({year}) ({month}) ({day}){sep}{month} {day}",
+        # eg "1984 Jul-Aug",
+        "({year}) ({month}){sep}{month}",
+        # eg "Winter 2019",
+        "({season}) ({year})",
+        # eg "2012",
+        "({year})",
+    ]
+]
+
+# Each entry is (pattern, month table, granularity), tried in order
+text_patterns = [
+    # eg "22 September 1983", strptime "%d %B %Y"
+    (
+        re.compile(r"(?P<day>\d{1,2})\s+(?P<month>[^\W\d_]+)\s+(?P<year>\d{4})"),
+        month_names,
+        "d",
+    ),
+    # eg "September 1983", strptime "%B %Y"
+    (re.compile(r"(?P<month>[^\W\d_]+)\s+(?P<year>\d{4})"), month_names, "m"),
+    # eg "1983", strptime "%Y"
+    (re.compile(r"(?P<year>\d{4})"), None, "y"),
+    # eg "September 22, 1983", strptime "%B %d, %Y"
+    (
+        re.compile(r"(?P<month>[^\W\d_]+)\s+(?P<day>\d{1,2}),\s+(?P<year>\d{4})"),
+        month_names,
+        "d",
+    ),
+    # eg "Sep-1983", strptime "%b-%Y"
+    (re.compile(r"(?P<month>[^\W\d_]+)-(?P<year>\d{4})"), month_abbreviations, "m"),
+]
+
+
+def parse_medline_date(s):
+    """
+    Parse a PubMed MedlineDate, e.g. "2007 Aug 9-Sep 12", taking the
+    start of any range.
+    """
+    date, granularity = _parse_medline_date(s)
+    return {"date": date, "granularity": granularity}
+
+
+def parse_text_date(s):
+    """
+    Parse a Scopus date-text field, e.g. "22 September 1983". Returns no
+    date for formats we don't recognise or dates that don't exist.
+    """
+    date, granularity = _parse_text_date(s)
+    return {"date": date, "granularity": granularity}
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_medline_date(s):
+    for pattern in medline_patterns:
+        match = pattern.match(s)
+        if match:
+            groups = match.groups()
+            # Season is special case where year does not come first
+            if groups[0] in season_mapper:
+                month = season_mapper[groups[0]]
+                year = int(groups[1])
+                day = 1
+            else:
+                year = int(groups[0])
+
+                if len(groups) > 1:
+                    month = month_mapper[groups[1]]
+                else:
+                    month = 1
+
+                if len(groups) > 2:
+                    day = int(groups[2])
+                else:
+                    day = 1
+
+            granularity = {1: "y", 2: "m", 3: "d"}[len(groups)]
+
+            return (datetime.date(year, month, day), granularity)
+
+    return (None, None)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_text_date(s):
+    for pattern, months, granularity in text_patterns:
+        match = pattern.fullmatch(s)
+        if not match:
+            continue
+        parts = match.groupdict()
+        if months is None:
+            month = 1
+        else:
+            month = months.get(parts["month"].lower())
+            if month is None:
+                continue
+        try:
+            date = datetime.date(int(parts["year"]), month, int(parts.get("day", 1)))
+        except ValueError:
+            return (None, None)
+        return (date, granularity)
+
+    return (None, None)
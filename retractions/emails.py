@@ -0,0 +1,65 @@
+"""
+Compose the retraction alert mails sent to authors in the intervention group.
+
+The HTML and plain text bodies are rendered from their own templates in
+retractions/templates, from one context built from an author and their
+intervention pairs. The pairs are expected to have their citing and retracted
+papers, and the retracted papers' notices, already loaded, so composing a
+mail makes no queries.
+"""
+
+from django.template.loader import render_to_string
+
+
+def _descending(pairs, key):
+    """
+    Sort pairs by key descending, with nulls first as in Postgres
+    """
+    return sorted(pairs, key=lambda pair: (key(pair) is None, key(pair)), reverse=True)
+
+
+# TODO: check that comparison date is not null
+def context(author, pairs):
+    """
+    Template context for the mail to author about pairs
+    """
+    aliases = author.author_aliases.all()
+    assert len(aliases) > 0
+
+    pairs = _descending(pairs, lambda pair: pair.citingpaper.comparisondate)
+    # Group the pairs by citing paper, most recent scopus id first
+    by_citing_paper = {}
+    for pair in _descending(pairs, lambda pair: pair.citingpaper.scopus_id):
+        by_citing_paper.setdefault(pair.citingpaper.scopus_id, []).append(pair)
+    citations = [
+        (
+            citing_pairs[0].citingpaper,
+            [
+                (pair.retractedpaper, pair.retractedpaper.get_notice())
+                for pair in _descending(
+                    citing_pairs, lambda pair: pair.retractedpaper.comparisondate
+                )
+            ],
+        )
+        for citing_pairs in by_citing_paper.values()
+    ]
+    return {
+        "name": aliases[0].full_name(),
+        "recentest_citing_paper": pairs[0].citingpaper,
+        "citations": citations,
+        "several_papers": len({pair.retractedpaper.pmid for pair in pairs}) > 1,
+    }
+
+
+def render(context):
+    """
+    Render the subject, HTML body and plain text body of a mail
+    """
+    recentest_citing_paper = context["recentest_citing_paper"]
+    subject = (
+        "RetractoBot: You cited a retracted paper "
+        f"in your {recentest_citing_paper.journalname} paper published in {recentest_citing_paper.comparisondate.year}"
+    )
+    body_html = render_to_string("retractions/retraction_email.html", context)
+    body_text = render_to_string("retractions/retraction_email.txt", context)
+    return (subject, body_html.strip(), body_text.strip())
@@ -0,0 +1,134 @@
+"""
+Append-only archive of the retraction mails sent, so that any of them can
+be looked up when an author replies.
+
+Each message is written to its own gzipped file, named by a hash of its
+message id, next to a JSON file describing it. The description is also
+appended to index.jsonl, and to a file of the messages to the author, named
+by a hash of their AUID. Adding a message never rewrites earlier ones, so
+costs the same however big the archive is, and messages can be read
+straight from their message id or author AUID.
+"""
+
+import datetime
+import email
+import email.header
+import email.policy
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import re
+import shutil
+import threading
+
+
+class MailArchive:
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.index_path = self.path / "index.jsonl"
+        self.lock = threading.Lock()
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def message_path(self, message_id):
+        digest = hashlib.sha1(message_id.encode()).hexdigest()
+        return self.path / "messages" / digest[:2] / f"{digest}.eml.gz"
+
+    def entry_path(self, message_id):
+        return self.message_path(message_id).with_suffix("").with_suffix(".json")
+
+    def author_index_path(self, auid):
+        digest = hashlib.sha1(auid.encode()).hexdigest()
+        return self.path / "authors" / digest[:2] / f"{digest}.jsonl"
+
+    def add(self, message, message_id=None, auid=None):
+        """
+        Archive message, an email.message.Message, under message_id (by
+        default its Message-ID header), returning its path
+        """
+        if message_id is None:
+            message_id = message["Message-ID"]
+        message_id = message_id.strip("<>")
+        path = self.message_path(message_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "message_id": message_id,
+            "auid": auid,
+            "to": unfold(message["To"]),
+            "subject": unfold(message["Subject"]),
+            "archived_at": datetime.datetime.now().isoformat(),
+            "path": str(path.relative_to(self.path)),
+        }
+        line = (json.dumps(entry) + "\n").encode()
+        with gzip.open(self._partial(path), "wb") as f:
+            f.write(message.as_bytes())
+        self._replace(path)
+        with open(self._partial(self.entry_path(message_id)), "wb") as f:
+            f.write(line)
+        self._replace(self.entry_path(message_id))
+
+        self._append(self.index_path, line)
+        if auid is not None:
+            author_index_path = self.author_index_path(auid)
+            author_index_path.parent.mkdir(parents=True, exist_ok=True)
+            self._append(author_index_path, line)
+        return path
+
+    def _partial(self, path):
+        # Write then rename, so a file is never read half written
+        return path.with_name(f"{path.name}.partial")
+
+    def _replace(self, path):
+        os.replace(self._partial(path), path)
+
+    def _append(self, path, line):
+        # A single write in append mode, so lines from other processes
+        # archiving at the same time aren't interleaved
+        with self.lock:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def get(self, message_id):
+        """
+        The archived message with message_id, or None
+        """
+        path = self.message_path(message_id.strip("<>"))
+        if not path.exists():
+            return None
+        with gzip.open(path, "rb") as f:
+            return email.message_from_binary_file(f, policy=email.policy.default)
+
+    def entries(self, message_id=None, auid=None):
+        """
+        Index entries for the archived messages, optionally only those with
+        message_id or to the author with auid, in the order they were added
+        """
+        if message_id is not None:
+            path = self.entry_path(message_id.strip("<>"))
+        elif auid is not None:
+            path = self.author_index_path(auid)
+        else:
+            path = self.index_path
+        if not path.exists():
+            return
+        with open(path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if auid is not None and entry["auid"] != auid:
+                    continue
+                yield entry
+
+
+def unfold(header):
+    """
+    A header value on one line, as it may have been folded over several,
+    and with any encoded words decoded
+    """
+    value = re.sub(r"\r?\n(?=[ \t])", "", str(header))
+    return str(email.header.make_header(email.header.decode_header(value)))
@@ -1,20 +1,20 @@
+import datetime
 import logging
+from concurrent import futures
 
-import anymail.exceptions
-import anymail.utils
-from django.contrib.postgres.aggregates import ArrayAgg
 from django.core.exceptions import MultipleObjectsReturned
 from django.core.management import BaseCommand, call_command
-from django.core.paginator import Paginator
-from django.db import transaction
-from django.db.models import Count, F, Q
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q
 
 from common import fetch_utils, setup
 from retractions.models import (
     Author,
     AuthorAlias,
     CitationRetractionPair,
+    RetractedAuthorsCursor,
     RetractedPaper,
+    RetractionNotice,
 )
 
 
@@ -28,14 +28,89 @@ class Command(BaseCommand):
             action="store_true",
             help="Query scopus for retracted authors",
         )
+        parser.add_argument(
+            "--after-pmid",
+            help="Query scopus for retracted authors after this pmid, rather "
+            "than after the last one an unfinished run saved",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Recompute contactable authors for every pair, not just those "
+            "which changed since the last run",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10000,
+            help="Number of pairs to compute contactable authors for at a time",
+        )
+
+    def _get_retracted_authors(self, batch=None, after_pmid=None):
+        """
+        Query scopus for the authors of retracted papers which have none.
+        The work list is fixed up front and walked in pmid order, fetching
+        the next page from scopus while the current one is saved. Progress is
+        saved after each page, and an interrupted run is carried on by the
+        next one, unless after_pmid is given
+        """
+        papers_to_update = (
+            RetractedPaper.objects.filter(scopus_id__isnull=False)
+            .annotate(count=Count("authors"))
+            .filter(count=0)
+        )
+        cursor = RetractedAuthorsCursor.objects.first()
+        if not after_pmid and cursor is not None:
+            after_pmid = cursor.pmid
+            logging.info(f"Carrying on from an unfinished run, after pmid {after_pmid}")
+        if after_pmid:
+            papers_to_update = papers_to_update.filter(pmid__gt=after_pmid)
+        # NOTE: page over a list rather than the queryset, as saving authors
+        # removes papers from the queryset and pages would be skipped
+        pmids = list(papers_to_update.order_by("pmid").values_list("pmid", flat=True))
+        total = len(pmids)
+        if total == 0:
+            logging.info("No retracted papers without authors")
+            RetractedAuthorsCursor.objects.all().delete()
+            return
 
-    def _set_scopus_details_parallel(self, retracted_papers):
+        if not batch:
+            batch = total
+        pages = [pmids[i : i + batch] for i in range(0, total, batch)]
         logging.info(
-            "Getting details of %d retracted papers in parallel",
-            retracted_papers.count(),
+            f"Getting details of {total} retracted papers in {len(pages)} pages"
+        )
+        with futures.ThreadPoolExecutor(1) as prefetcher:
+            fetching = self._fetch_scopus_details(prefetcher, pages[0])
+            for i, page in enumerate(pages, 1):
+                retracted_papers, responses = fetching
+                rs = responses.result()
+                if i < len(pages):
+                    fetching = self._fetch_scopus_details(prefetcher, pages[i])
+                logging.info(f"({i}/{len(pages)}) Saving {len(page)} retracted papers")
+                self._save_scopus_details(retracted_papers, rs)
+                RetractedAuthorsCursor.objects.update_or_create(
+                    pk=1, defaults={"pmid": page[-1]}
+                )
+                logging.info(f"Done up to pmid {page[-1]}")
+        # Finished, so the next run starts from the beginning
+        RetractedAuthorsCursor.objects.all().delete()
+
+    def _fetch_scopus_details(self, prefetcher, pmids):
+        """
+        Start fetching scopus details of a page of retracted papers, returning
+        the papers and a future for the responses
+        """
+        retracted_papers = list(
+            RetractedPaper.objects.filter(pmid__in=pmids).order_by("pmid")
         )
         urls = [r.scopus_paper_url() for r in retracted_papers]
-        rs = fetch_utils.fetch_urls_parallel(urls, is_scopus=True)
+        return (
+            retracted_papers,
+            prefetcher.submit(fetch_utils.fetch_urls_parallel, urls, is_scopus=True),
+        )
+
+    def _save_scopus_details(self, retracted_papers, rs):
         datas = [
             self._process_scopus_json(r.json(), retracted_paper)
             for r, retracted_paper in zip(rs, retracted_papers)
@@ -140,79 +215,137 @@ class Command(BaseCommand):
                     )
                     author_alias.save()
 
-    def _update_contactable_authors(self):
+    def _dirty_pairs(self):
+        """
+        Pairs whose contactable authors have never been computed, or whose
+        citing paper, retracted paper, retraction notices, authors or author
+        aliases changed since they last were
+        """
+        computed_at = OuterRef("contactable_authors_updated_at")
+        changed_authors = Q(updated_at__gt=computed_at) | Q(
+            author_aliases__updated_at__gt=computed_at
+        )
+        return CitationRetractionPair.objects.filter(
+            Q(contactable_authors_updated_at__isnull=True)
+            | Q(citingpaper__updated_at__gt=F("contactable_authors_updated_at"))
+            | Q(retractedpaper__updated_at__gt=F("contactable_authors_updated_at"))
+            | Exists(
+                Author.objects.filter(
+                    changed_authors, citing_papers=OuterRef("citingpaper")
+                )
+            )
+            | Exists(
+                Author.objects.filter(
+                    changed_authors, retracted_papers=OuterRef("retractedpaper")
+                )
+            )
+            | Exists(
+                RetractionNotice.objects.filter(
+                    papers=OuterRef("retractedpaper"), updated_at__gt=computed_at
+                )
+            )
+        )
+
+    def _update_contactable_authors(self, full=False, chunk_size=10000):
         """
         Filter contactable authors to those with at least one email address
         For every pair, remove retracted authors from citing authors
         (self-citing)
+
+        Unless full is set, only pairs which changed since they were last
+        computed are recomputed. Pairs are streamed from a server-side cursor
+        and written chunk_size at a time, so memory use doesn't grow with the
+        number of pairs
         """
-        corrupted = []
-        for alias in AuthorAlias.objects.exclude(email_address__isnull=True):
-            try:
-                anymail.utils.parse_single_address(alias.email_address)
-            except anymail.exceptions.AnymailInvalidAddress:
-                corrupted.append(alias.id)
+        computed_at = datetime.datetime.now()
+        if full:
+            dirty = CitationRetractionPair.objects.all()
+        else:
+            dirty = self._dirty_pairs()
+
+        total = 0
+        pair_ids = []
+        for pair_id in dirty.values_list("pk", flat=True).iterator(
+            chunk_size=chunk_size
+        ):
+            pair_ids.append(pair_id)
+            if len(pair_ids) >= chunk_size:
+                total += self._update_contactable_authors_chunk(pair_ids, computed_at)
+                pair_ids = []
+        if pair_ids:
+            total += self._update_contactable_authors_chunk(pair_ids, computed_at)
+        logging.info(f"Added {total} contactable authors")
 
+    def _update_contactable_authors_chunk(self, pair_ids, computed_at):
         # Exclude citation by notice
-        pairs = CitationRetractionPair.objects.exclude(
-            Q(retractedpaper__notices__pmid=F("citingpaper__pmid"))
-            | Q(citingpaper__pub_types__contains=["Retraction of Publication"])
-        ).exclude(citingpaper__comparisondate__isnull=True)
-        # Exclude if the citing paper had no date (likely no authors anyway)
-        pairs = pairs.annotate(
-            retracted_authors=ArrayAgg(
-                "retractedpaper__authors__auid",
-                distinct=True,
-                filter=~Q(retractedpaper__authors__author_aliases__email_address=None),
-                default=[],
-            )
-        ).annotate(
-            citing_authors=ArrayAgg(
-                "citingpaper__authors__auid",
-                distinct=True,
-                filter=~(
-                    Q(citingpaper__authors__author_aliases__email_address=None)
-                    | Q(citingpaper__authors__author_aliases__in=corrupted)
-                ),
-                default=[],
+        pairs = (
+            CitationRetractionPair.objects.filter(pk__in=pair_ids)
+            .exclude(
+                Q(retractedpaper__notices__pmid=F("citingpaper__pmid"))
+                | Q(citingpaper__pub_types__contains=["Retraction of Publication"])
             )
+            .exclude(citingpaper__comparisondate__isnull=True)
         )
+        # Exclude if the citing paper had no date (likely no authors anyway)
+        pairs_sql, pairs_params = pairs.values("pk").query.sql_with_params()
 
-        # TODO: make this more efficient, we should not run db query in loop
-        # But "add" already calls a bulk update save
-        # Would need to find a better way to do the set difference query
+        # Citing authors with a usable email address, less any author of the
+        # retracted paper who has an email address
         with transaction.atomic():
-            for pair in pairs:
-                authors = Author.objects.filter(
-                    auid__in=list(
-                        set(pair.citing_authors) - set(pair.retracted_authors)
+            Author.pairs.through.objects.filter(
+                citationretractionpair__in=pair_ids
+            ).delete()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    INSERT INTO author_pairs (author_id, citationretractionpair_id)
+                    SELECT author.id, pair.id
+                    FROM citing_paper_paper pair
+                    JOIN author_citing_papers citing
+                        ON citing.citingpaper_id = pair.citingpaper_id
+                    JOIN author ON author.id = citing.author_id
+                    WHERE pair.id IN ({pairs_sql})
+                    AND author.auid IS NOT NULL
+                    AND EXISTS (
+                        SELECT 1 FROM author_alias alias
+                        WHERE alias.author_id = author.id
+                        AND alias.email_address IS NOT NULL
+                        AND alias.email_valid
+                    )
+                    AND NOT EXISTS (
+                        SELECT 1 FROM author_retracted_papers retracted
+                        JOIN author_alias alias
+                            ON alias.author_id = retracted.author_id
+                        WHERE retracted.retractedpaper_id = pair.retractedpaper_id
+                        AND retracted.author_id = author.id
+                        AND alias.email_address IS NOT NULL
                     )
+                    """,
+                    pairs_params,
                 )
-                pair.contactable_authors.clear()
-                pair.contactable_authors.add(*authors)
+                added = cursor.rowcount
+            CitationRetractionPair.objects.filter(pk__in=pair_ids).update(
+                contactable_authors_updated_at=computed_at
+            )
+        logging.info(f"Computed contactable authors for {len(pair_ids)} pairs")
+        return added
 
     def handle(self, *args, **kwargs):
         setup.setup_logger(kwargs["verbosity"])
         batch = kwargs.get("batch")
         get_retracted_authors = kwargs.get("get_retracted_authors")
+        full = kwargs.get("full")
+        # Not set when handle is called without parsing the arguments
+        chunk_size = kwargs.get("chunk_size") or 10000
         if get_retracted_authors:
-            papers_to_update = (
-                RetractedPaper.objects.filter(scopus_id__isnull=False)
-                .annotate(count=Count("authors"))
-                .filter(count=0)
-                .order_by("pmid")
-            )
-
             logging.info("Querying scopus for retracted paper authors")
-            if not batch:
-                batch = papers_to_update.count()
-            if batch == 0:
-                return
-            paginator = Paginator(papers_to_update, batch)
-            for i in range(paginator.num_pages):
-                self._set_scopus_details_parallel(paginator.get_page(i).object_list)
+            self._get_retracted_authors(batch, kwargs.get("after_pmid"))
         logging.info("Ensuring comparison date is populated")
         call_command("update_comparison_date")
+        logging.info("Ensuring author email addresses are validated")
+        call_command("validate_author_aliases")
         logging.info("Starting update of contactable authors")
-        self._update_contactable_authors()
+        self._update_contactable_authors(full=full, chunk_size=chunk_size)
         logging.info("Finished update of contactable authors")
+        logging.info("Updating retracted paper summaries")
+        call_command("update_paper_summaries")
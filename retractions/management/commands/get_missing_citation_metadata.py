@@ -1,7 +1,9 @@
 import argparse
+import concurrent.futures as futures
 import datetime
 import logging
 
+import orjson
 from django.core.management.base import BaseCommand
 from django.core.paginator import Paginator
 from django.db import transaction
@@ -9,13 +11,14 @@ from django.db.models import Q
 
 import retractions.pubmed as pubmed
 from common import fetch_utils, setup
+from retractions import dates
 from retractions.models import Author, AuthorAlias, CitingPaper
 
 
 def pos_int(val):
     ival = int(val)
     if ival <= 0:
-        raise argparse.ArgumentTypeError("Batch must be a positive int")
+        raise argparse.ArgumentTypeError(f"Not a positive int: {val!r}")
     return ival
 
 
@@ -27,12 +30,196 @@ def valid_date(s):
         raise argparse.ArgumentTypeError(msg)
 
 
+def _scopus_json_date(d):
+    if d is None:
+        return None
+    if "@year" in d:
+        assert d["@year"].isdigit()
+        assert d["@month"].isdigit()
+        assert d["@day"].isdigit()
+        return datetime.date(int(d["@year"]), int(d["@month"]), int(d["@day"]))
+    assert d["year"].isdigit()
+    y = int(d["year"])
+    if "month" in d:
+        assert d["month"].isdigit()
+        m = int(d["month"])
+    else:
+        m = 1
+    if "day" in d:
+        assert d["day"].isdigit()
+        d = int(d["day"])
+    else:
+        d = 1
+    return datetime.date(y, m, d)
+
+
+def _scopus_text_date(d):
+    if d is None:
+        return None
+    if "date-text" not in d:
+        return None
+    if isinstance(d["date-text"], str):
+        t = d["date-text"]
+    else:
+        t = d["date-text"]["$"]
+    return dates.parse_text_date(t)["date"]
+
+
+def _safeget(dct, *keys):
+    for key in keys:
+        try:
+            dct = dct[key]
+        except KeyError:
+            return None
+    return dct
+
+
+def process_scopus_json(res, has_pmid=False):
+    data = {}
+    fields = [
+        "eid",
+        "pubmed-id",
+        "prism:doi",
+        "prism:issn",
+        "dc:title",
+        "prism:publicationName",
+        "prism:coverDate",
+    ]
+    for f in fields:
+        data[f] = None
+    data["authors"] = []
+
+    if "abstracts-retrieval-response" not in res:
+        raise Exception("No abstracts-retrieval-response")
+    arr = res["abstracts-retrieval-response"]
+
+    d = arr["coredata"]
+    for f in fields:
+        if f in d:
+            data[f] = d[f]
+    item = arr["item"]
+    if (
+        "bibrecord" in item
+        and "head" in item["bibrecord"]
+        and "author-group" in item["bibrecord"]["head"]
+    ):
+        author_group = item["bibrecord"]["head"]["author-group"]
+        if isinstance(author_group, dict):
+            if "author" in author_group:
+                if isinstance(author_group["author"], dict):
+                    data["authors"] += [author_group["author"]]
+                else:
+                    data["authors"] += author_group["author"]
+        else:
+            for a in author_group:
+                if "author" in a:
+                    if isinstance(a["author"], dict):
+                        data["authors"] += [a["author"]]
+                    else:
+                        data["authors"] += a["author"]
+
+    # For debugging write out dates separately
+    info = {
+        "doi": data["prism:doi"],
+        "dc:title": data["dc:title"],
+        "prism:publicationName": data["prism:publicationName"],
+        "prism:coverDate": data["prism:coverDate"],
+    }
+    # Pubmed pmid is more reliable, so do not overwrite existing pmid
+    if not has_pmid:
+        info["pubmed-id"] = data["pubmed-id"]
+
+    info["ait:date-sort"] = _scopus_json_date(
+        _safeget(arr, "item", "ait:process-info", "ait:date-sort")
+    )
+    info["ait:date-delivered"] = _scopus_json_date(
+        _safeget(arr, "item", "ait:process-info", "ait:date-delivered")
+    )
+    info["bibrecord:date-created"] = _scopus_json_date(
+        _safeget(
+            arr,
+            "item",
+            "bibrecord",
+            "item-info",
+            "history",
+            "date-created",
+        )
+    )
+    info["bibrecord:publicationdate:numeric"] = _scopus_json_date(
+        _safeget(arr, "item", "bibrecord", "head", "source", "publicationdate")
+    )
+    info["bibrecord:publicationdate:text"] = _scopus_text_date(
+        _safeget(arr, "item", "bibrecord", "head", "source", "publicationdate")
+    )
+    info["bibrecord:confdate:startdate"] = _scopus_json_date(
+        _safeget(
+            arr,
+            "item",
+            "bibrecord",
+            "head",
+            "source",
+            "additional-srcinfo",
+            "conferenceinfo",
+            "confevent",
+            "confdate",
+            "startdate",
+        )
+    )
+    info["bibrecord:confdate:enddate"] = _scopus_json_date(
+        _safeget(
+            arr,
+            "item",
+            "bibrecord",
+            "head",
+            "source",
+            "additional-srcinfo",
+            "conferenceinfo",
+            "confevent",
+            "confdate",
+            "enddate",
+        )
+    )
+
+    data.update(info)
+    return data
+
+
+def _compact_author(a):
+    """Keep only the author fields that _update_citing_paper reads"""
+    author = {
+        key: a[key]
+        for key in ["@auid", "ce:surname", "ce:given-name", "ce:initials"]
+        if key in a
+    }
+    if "preferred-name" in a:
+        author["preferred-name"] = {
+            key: a["preferred-name"][key]
+            for key in ["ce:surname", "ce:given-name", "ce:initials"]
+            if key in a["preferred-name"]
+        }
+    if "ce:e-address" in a:
+        author["ce:e-address"] = {"$": a["ce:e-address"]["$"]}
+    return author
+
+
+def parse_scopus_response(body, has_pmid=False):
+    """
+    Decode and parse a raw Scopus abstract response in a worker process.
+    Only a compact record is sent back to the main process.
+    """
+    data = process_scopus_json(orjson.loads(body), has_pmid=has_pmid)
+    data["authors"] = [_compact_author(a) for a in data["authors"]]
+    return data
+
+
 class Command(BaseCommand):
     args = ""
     help = """Updates papers that cite retracted papers using metadata from
     scopus and pubmed. Only those papers missing data expected to be
     found in the respective sources will be scraped and updated."""  # noqa: A003
 
+    parse_pool = None
+
     def add_arguments(self, parser):
         parser.add_argument(
             "--scopus-only",
@@ -60,6 +247,11 @@ class Command(BaseCommand):
             action="store_true",
             help="Skip papers that previously had an error",
         )
+        parser.add_argument(
+            "--parse-workers",
+            type=pos_int,
+            help="Parse Scopus responses in this many worker processes",
+        )
 
     def handle(self, *args, **options):
         setup.setup_logger(options["verbosity"])
@@ -72,6 +264,7 @@ class Command(BaseCommand):
                 batch=batch,
                 created_after=created_after,
                 skip_errors=skip_errors,
+                parse_workers=options.get("parse_workers"),
             )
         if options["pubmed_only"] or both:
             self.update_citing_papers_pubmed(
@@ -81,10 +274,11 @@ class Command(BaseCommand):
             )
 
     def update_citing_papers_scopus(
-        self, batch=None, created_after=None, skip_errors=False
+        self, batch=None, created_after=None, skip_errors=False, parse_workers=None
     ):
         """Scopus provides things like DOI, Pubmed ID, title, some dates, and
-        authors.
+        authors. If parse_workers is set, responses are decoded and parsed in
+        a process pool so parsing is not limited by the GIL.
 
         """
         papers_to_get = CitingPaper.objects.filter(
@@ -94,7 +288,17 @@ class Command(BaseCommand):
             papers_to_get = papers_to_get.filter(created_at__gte=created_after)
         if skip_errors:
             papers_to_get = papers_to_get.exclude(errors="Scopus returned None")
-        self._paginate(papers_to_get, batch, self._set_scopus_details_parallel)
+        if not parse_workers:
+            self._paginate(papers_to_get, batch, self._set_scopus_details_parallel)
+            return
+
+        logging.info(f"Parsing Scopus responses in {parse_workers} processes")
+        with futures.ProcessPoolExecutor(parse_workers) as pool:
+            self.parse_pool = pool
+            try:
+                self._paginate(papers_to_get, batch, self._set_scopus_details_parallel)
+            finally:
+                self.parse_pool = None
 
     def update_citing_papers_pubmed(
         self, batch=None, created_after=None, skip_errors=False
@@ -147,15 +351,18 @@ class Command(BaseCommand):
     def _set_scopus_details_parallel(self, citing_papers):
         urls = [c.scopus_paper_url() for c in citing_papers]
         rs = fetch_utils.fetch_urls_parallel(urls, is_scopus=True)
-        datas = [
-            self._process_scopus_json(r.json(), citing_paper)
-            if r is not None
-            else {
-                "errors": "Scopus returned None",
-                "scopus_id": citing_paper.scopus_id,
-            }
-            for r, citing_paper in zip(rs, citing_papers)
-        ]
+        if self.parse_pool:
+            datas = self._process_scopus_responses_in_pool(rs, citing_papers)
+        else:
+            datas = [
+                self._process_scopus_json(r.json(), citing_paper)
+                if r is not None
+                else {
+                    "errors": "Scopus returned None",
+                    "scopus_id": citing_paper.scopus_id,
+                }
+                for r, citing_paper in zip(rs, citing_papers)
+            ]
         for citing_paper_data in datas:
             try:
                 scopus_id = citing_paper_data["eid"].replace("2-s2.0-", "")
@@ -164,6 +371,26 @@ class Command(BaseCommand):
             logging.info(f"Updating citing paper {scopus_id} from scopus")
             self._update_citing_paper(scopus_id, citing_paper_data)
 
+    def _process_scopus_responses_in_pool(self, rs, citing_papers):
+        fs = [
+            self.parse_pool.submit(
+                parse_scopus_response, r.content, has_pmid=bool(citing_paper.pmid)
+            )
+            if r is not None
+            else None
+            for r, citing_paper in zip(rs, citing_papers)
+        ]
+        # Pull out results separately, so we get them in the right order
+        return [
+            f.result()
+            if f is not None
+            else {
+                "errors": "Scopus returned None",
+                "scopus_id": citing_paper.scopus_id,
+            }
+            for f, citing_paper in zip(fs, citing_papers)
+        ]
+
     def _set_pubmed_details_parallel(self, citing_papers):
         logging.info("Getting PMID for citing papers in parallel via DOI")
 
@@ -233,169 +460,7 @@ class Command(BaseCommand):
         return data
 
     def _process_scopus_json(self, res, citing_paper):
-        data = {}
-        fields = [
-            "eid",
-            "pubmed-id",
-            "prism:doi",
-            "prism:issn",
-            "dc:title",
-            "prism:publicationName",
-            "prism:coverDate",
-        ]
-        for f in fields:
-            data[f] = None
-        data["authors"] = []
-
-        if "abstracts-retrieval-response" not in res:
-            raise Exception("No abstracts-retrieval-response")
-        arr = res["abstracts-retrieval-response"]
-
-        d = arr["coredata"]
-        for f in fields:
-            if f in d:
-                data[f] = d[f]
-        item = arr["item"]
-        if (
-            "bibrecord" in item
-            and "head" in item["bibrecord"]
-            and "author-group" in item["bibrecord"]["head"]
-        ):
-            author_group = item["bibrecord"]["head"]["author-group"]
-            if isinstance(author_group, dict):
-                if "author" in author_group:
-                    if isinstance(author_group["author"], dict):
-                        data["authors"] += [author_group["author"]]
-                    else:
-                        data["authors"] += author_group["author"]
-            else:
-                for a in author_group:
-                    if "author" in a:
-                        if isinstance(a["author"], dict):
-                            data["authors"] += [a["author"]]
-                        else:
-                            data["authors"] += a["author"]
-
-        # For debugging write out dates separately
-        info = {
-            "doi": data["prism:doi"],
-            "dc:title": data["dc:title"],
-            "prism:publicationName": data["prism:publicationName"],
-            "prism:coverDate": data["prism:coverDate"],
-        }
-        # Pubmed pmid is more reliable, so do not overwrite existing pmid
-        if not citing_paper.pmid:
-            info["pubmed-id"] = data["pubmed-id"]
-
-        def _scopus_json_date(d):
-            if d is None:
-                return None
-            if "@year" in d:
-                assert d["@year"].isdigit()
-                assert d["@month"].isdigit()
-                assert d["@day"].isdigit()
-                return datetime.date(int(d["@year"]), int(d["@month"]), int(d["@day"]))
-            assert d["year"].isdigit()
-            y = int(d["year"])
-            if "month" in d:
-                assert d["month"].isdigit()
-                m = int(d["month"])
-            else:
-                m = 1
-            if "day" in d:
-                assert d["day"].isdigit()
-                d = int(d["day"])
-            else:
-                d = 1
-            return datetime.date(y, m, d)
-
-        def _scopus_text_date(d):
-            if d is None:
-                return None
-            if "date-text" not in d:
-                return None
-            if isinstance(d["date-text"], str):
-                t = d["date-text"]
-            else:
-                t = d["date-text"]["$"]
-            try:
-                return datetime.datetime.strptime(t, "%d %B %Y").date()
-            except ValueError:
-                try:
-                    return datetime.datetime.strptime(t, "%B %Y").date()
-                except ValueError:
-                    try:
-                        return datetime.datetime.strptime(t, "%Y").date()
-                    except ValueError:
-                        try:
-                            return datetime.datetime.strptime(t, "%B %d, %Y").date()
-                        except ValueError:
-                            try:
-                                return datetime.datetime.strptime(t, "%b-%Y").date()
-                            except ValueError:
-                                return None
-
-        def _safeget(dct, *keys):
-            for key in keys:
-                try:
-                    dct = dct[key]
-                except KeyError:
-                    return None
-            return dct
-
-        info["ait:date-sort"] = _scopus_json_date(
-            _safeget(arr, "item", "ait:process-info", "ait:date-sort")
-        )
-        info["ait:date-delivered"] = _scopus_json_date(
-            _safeget(arr, "item", "ait:process-info", "ait:date-delivered")
-        )
-        info["bibrecord:date-created"] = _scopus_json_date(
-            _safeget(
-                arr,
-                "item",
-                "bibrecord",
-                "item-info",
-                "history",
-                "date-created",
-            )
-        )
-        info["bibrecord:publicationdate:numeric"] = _scopus_json_date(
-            _safeget(arr, "item", "bibrecord", "head", "source", "publicationdate")
-        )
-        info["bibrecord:publicationdate:text"] = _scopus_text_date(
-            _safeget(arr, "item", "bibrecord", "head", "source", "publicationdate")
-        )
-        info["bibrecord:confdate:startdate"] = _scopus_json_date(
-            _safeget(
-                arr,
-                "item",
-                "bibrecord",
-                "head",
-                "source",
-                "additional-srcinfo",
-                "conferenceinfo",
-                "confevent",
-                "confdate",
-                "startdate",
-            )
-        )
-        info["bibrecord:confdate:enddate"] = _scopus_json_date(
-            _safeget(
-                arr,
-                "item",
-                "bibrecord",
-                "head",
-                "source",
-                "additional-srcinfo",
-                "conferenceinfo",
-                "confevent",
-                "confdate",
-                "enddate",
-            )
-        )
-
-        data.update(info)
-        return data
+        return process_scopus_json(res, has_pmid=bool(citing_paper.pmid))
 
     def _update_citing_paper(self, scopus_id, data):
         with transaction.atomic():
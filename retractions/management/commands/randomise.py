@@ -2,22 +2,41 @@ import argparse
 import datetime
 import logging
 import pathlib
-import random
 from collections import Counter
 from datetime import timedelta
-from functools import partial
-from multiprocessing import Pool
 
 import numpy
 import pandas
 from django.core.exceptions import EmptyResultSet
 from django.core.management import BaseCommand, call_command
-from django.db import transaction
-from django.db.models import Case, Count, Max, Min, Q, Value, When
+from django.db.models import (
+    Case,
+    Count,
+    Exists,
+    F,
+    Max,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThanOrEqual
 from tableone import TableOne
 
 from common import setup
-from retractions.models import CitationRetractionPair, CitingPaper, RetractedPaper
+from retractions import allocation, datasets
+from retractions.models import (
+    Author,
+    CitationRetractionPair,
+    CitingPaper,
+    Randomisation,
+    RetractedPaper,
+    RetractedPaperSummary,
+    RetractedPaperYearSummary,
+)
 
 
 pilot = [
@@ -51,6 +70,13 @@ manual_cuts = {
 }
 
 
+def pos_int(val):
+    ival = int(val)
+    if ival <= 0:
+        raise argparse.ArgumentTypeError(f"Not a positive int: {val!r}")
+    return ival
+
+
 def valid_date(s):
     try:
         return datetime.datetime.strptime(s, "%Y-%m-%d").date()
@@ -117,10 +143,11 @@ def gen_simulation(options):
     randomisation_year = options["simulated_randomisation_year"]
     simulation_file = options["simulation_file"]
     num_simulations = options["num_simulations"]
+    call_command("update_paper_summaries")
     # Exclude x in case there is a stored randomisation in the db
     papers = (
         RetractedPaper.objects.annotate(
-            earliest_notice=Min("notices__comparisondate__year")
+            earliest_notice=F("summary__earliest_notice_year")
         )
         .exclude(rct_group="x")
         .filter(comparisondate__year__lte=randomisation_year)
@@ -129,7 +156,7 @@ def gen_simulation(options):
     papers = _annotate_count_unique(papers, randomisation_year)
     papers = papers.exclude(count_unique=0)
     decile_cuts = numpy.quantile(
-        list(papers.values_list("count_unique", flat=True)),
+        datasets.values_table(papers, "count_unique")["count_unique"].to_numpy(),
         numpy.arange(0.1, 1.1, 0.1),
     )
     decile_dict = {round(cut): index for index, cut in enumerate(decile_cuts, start=1)}
@@ -137,11 +164,25 @@ def gen_simulation(options):
     papers = _annotate_strata(papers, "groups", manual_cuts, update=False)
     papers = _annotate_strata(papers, "deciles", decile_dict, update=False)
 
+    seed_sequence = _seed_sequence(
+        options["seed"], simulated=True, count=num_simulations
+    )
+    groups_seed_sequence, deciles_seed_sequence = seed_sequence.spawn(2)
     res_groups = _randomise_parallel_or_update(
-        papers, "groups", update=False, count=num_simulations
+        papers,
+        "groups",
+        groups_seed_sequence,
+        update=False,
+        count=num_simulations,
+        workers=options["workers"],
     )
     res_deciles = _randomise_parallel_or_update(
-        papers, "deciles", update=False, count=num_simulations
+        papers,
+        "deciles",
+        deciles_seed_sequence,
+        update=False,
+        count=num_simulations,
+        workers=options["workers"],
     )
     randomisations = pandas.concat([res_groups, res_deciles], axis=1)
     randomisations.index.name = "pmid"
@@ -149,26 +190,24 @@ def gen_simulation(options):
     # Count the papers that cited in the year after randomisation
     # Ignore the wash out period in simulation, as there's no intervention
     papers = papers.annotate(
-        citation_count=Count(
-            "citationretractionpair",
-            filter=Q(
-                citationretractionpair__citingpaper__comparisondate__year=randomisation_year
-                + 1
+        citation_count=Coalesce(
+            Subquery(
+                RetractedPaperYearSummary.objects.filter(
+                    retractedpaper=OuterRef("pk"), year=randomisation_year + 1
+                ).values("citation_count")
             ),
-            distinct=True,
+            0,
         )
     )
-    papers = papers.annotate(earliest_notice=Min("notices__comparisondate__year"))
-    df = pandas.DataFrame(
-        papers.values(
-            "pmid",
-            "count_unique",
-            "citation_count",
-            "groups",
-            "deciles",
-            "comparisondate__year",
-            "earliest_notice",
-        )
+    df = datasets.values_frame(
+        papers,
+        "pmid",
+        "count_unique",
+        "citation_count",
+        "groups",
+        "deciles",
+        "comparisondate__year",
+        "earliest_notice",
     )
     df = df.set_index("pmid")
     df = pandas.merge(df, randomisations, on="pmid")
@@ -180,7 +219,10 @@ def gen_simulation(options):
     df["years_since_publication_q4"] = pandas.qcut(
         df.years_since_publication, q=4, labels=[0, 1, 2, 3]
     )
-    df.to_csv(simulation_file)
+    df["seed"] = str(seed_sequence.entropy)
+    datasets.write_dataset(
+        df, simulation_file, options["format"], treatment=list(randomisations)
+    )
 
 
 def set_randomisation(options):
@@ -194,7 +236,10 @@ def set_randomisation(options):
 
     # Set all citing papers as cited_in_rct
     # Pre-rct citing paper authors are used in stratification
-    CitingPaper.objects.update(cited_in_rct=True)
+    CitingPaper.objects.filter(cited_in_rct=False).update(
+        cited_in_rct=True, updated_at=datetime.datetime.now()
+    )
+    call_command("update_paper_summaries")
 
     randomisation_year = datetime.datetime.now().date().year
     just_check = options["just_check"]
@@ -211,7 +256,10 @@ def set_randomisation(options):
         return
     papers = _annotate_count_unique(papers)
     papers = _annotate_strata(papers, "groups", manual_cuts, update=True)
-    _randomise_parallel_or_update(papers, "stratifying_group", update=True)
+    seed_sequence = _seed_sequence(options["seed"], simulated=False, count=1)
+    _randomise_parallel_or_update(
+        papers, "stratifying_group", seed_sequence, update=True
+    )
     table1 = check_randomisation(randomisation_year)
     logging.info(table1.tabulate(tablefmt="fancy_grid"))
 
@@ -219,16 +267,15 @@ def set_randomisation(options):
 def check_randomisation(randomisation_year):
     papers = RetractedPaper.objects.filter(Q(rct_group="c") | Q(rct_group="i"))
     papers = _annotate_count_unique(papers)
-    papers = papers.annotate(earliest_notice=Min("notices__comparisondate__year"))
-    df = pandas.DataFrame(
-        papers.values(
-            "pmid",
-            "rct_group",
-            "stratifying_group",
-            "count_unique",
-            "comparisondate__year",
-            "earliest_notice",
-        )
+    papers = papers.annotate(earliest_notice=F("summary__earliest_notice_year"))
+    df = datasets.values_frame(
+        papers,
+        "pmid",
+        "rct_group",
+        "stratifying_group",
+        "count_unique",
+        "comparisondate__year",
+        "earliest_notice",
     )
     df["years_since_retraction"] = randomisation_year - df["earliest_notice"]
     df["years_since_publication"] = randomisation_year - df["comparisondate__year"]
@@ -261,86 +308,93 @@ def check_randomisation(randomisation_year):
     return table1
 
 
-def _annotate_strata(papers, stratifying_name, stratifying_dict, update=True):
+def _strata(count_unique, stratifying_dict):
     whens = [
-        When(count_unique__gte=k, then=Value(v))
+        When(GreaterThanOrEqual(count_unique, k), then=Value(v))
         for k, v in sorted(stratifying_dict.items(), reverse=True)
     ]
-    annotation = {f"{stratifying_name}": Case(*whens)}
-    papers = papers.annotate(**annotation)
+    return Case(*whens)
+
+
+def _annotate_strata(papers, stratifying_name, stratifying_dict, update=True):
+    annotation = {f"{stratifying_name}": _strata(F("count_unique"), stratifying_dict)}
     if update:
-        with transaction.atomic():
-            for paper in papers:
-                paper.stratifying_group = getattr(paper, stratifying_name)
-                paper.save(update_fields=["stratifying_group"])
-    return papers
+        # Set every paper's stratum in one UPDATE, computing the count in the
+        # database as joins can't be referenced in an update
+        RetractedPaper.objects.filter(pk__in=papers.values("pk")).update(
+            stratifying_group=_strata(_count_unique(), stratifying_dict)
+        )
+    return papers.annotate(**annotation)
 
 
-def _annotate_count_unique(papers, randomisation_year=None):
+def _count_unique(randomisation_year=None):
+    """
+    Distinct contactable authors of a retracted paper from the paper
+    summaries, which update_paper_summaries keeps up to date
+    """
     # When running a simulation, we want to use the date not the rct field
     if randomisation_year:
-        papers = papers.annotate(
-            count_unique=Count(
-                "citationretractionpair__contactable_authors",
-                filter=Q(
-                    citationretractionpair__citingpaper__comparisondate__year__lte=randomisation_year
-                ),
-                distinct=True,
+        count_unique = Subquery(
+            RetractedPaperYearSummary.objects.filter(
+                retractedpaper=OuterRef("pk"), year__lte=randomisation_year
             )
+            .values("retractedpaper")
+            .annotate(total=Sum("new_contactable_authors"))
+            .values("total")
         )
     else:
-        papers = papers.annotate(
-            count_unique=Count(
-                "citationretractionpair__contactable_authors",
-                filter=Q(citationretractionpair__citingpaper__cited_in_rct=True),
-                distinct=True,
+        count_unique = Subquery(
+            RetractedPaperSummary.objects.filter(retractedpaper=OuterRef("pk")).values(
+                "count_unique_in_rct"
             )
         )
-    return papers
-
-
-def _randomise(df, stratifying_name="groups"):
-    groups = df.groupby(stratifying_name)
-    intervention = []
-    control = []
-    for group_name, group_data in groups:
-        logging.info(f"Randomising {stratifying_name:} {group_name}")
-        group_data["random"] = numpy.random.random(len(group_data))
-        group_data = group_data.sort_values(by="random")
-        pmids = list(group_data.pmid)
-        total = len(pmids)
-        intervention += pmids[0 : total // 2]
-        control += pmids[-(total // -2) :]
-        # Randomly assign middle value if there are an odd number of values
-        middle = pmids[(total // 2) : -(total // -2)]
-        if random.randint(0, 1):
-            intervention += middle
-        else:
-            control += middle
-    # Difference should be bounded by the number of strata
-    assert len(set(control)) + len(set(intervention)) == len(df)
-    assert abs(len(set(control)) - len(set(intervention))) <= len(groups)
-    return pandas.concat(
-        [
-            pandas.Series("i", index=intervention),
-            pandas.Series("c", index=control),
-        ]
+    return Coalesce(count_unique, 0)
+
+
+def _annotate_count_unique(papers, randomisation_year=None):
+    return papers.annotate(count_unique=_count_unique(randomisation_year))
+
+
+def _seed_sequence(seed, simulated, count):
+    """
+    The SeedSequence randomisations are spawned from, recording its seed so
+    that they can be reproduced with --seed
+    """
+    seed_sequence = numpy.random.SeedSequence(seed)
+    logging.info(f"Randomising with seed {seed_sequence.entropy}")
+    Randomisation.objects.create(
+        seed=str(seed_sequence.entropy), simulated=simulated, count=count
+    )
+    return seed_sequence
+
+
+def _randomise(df, stratifying_name, seed_sequence, count, workers=1):
+    """
+    Randomise the papers in df count times within their strata, each time
+    with a Generator spawned from seed_sequence, across workers processes.
+    Returns an int8 matrix with a row per randomisation and a column per paper
+    """
+    allocations = allocation.allocate_parallel(
+        df[stratifying_name].to_numpy(), seed_sequence, count, workers=workers
     )
+    # Difference should be bounded by the number of strata
+    intervention = (allocations == allocation.INTERVENTION).sum(axis=1)
+    control = len(df) - intervention
+    assert (abs(control - intervention) <= df[stratifying_name].nunique()).all()
+    return allocations
 
 
-def _randomise_parallel_or_update(papers, stratifying_name, update=True, count=1):
-    df = pandas.DataFrame(papers.values("pmid", stratifying_name))
+def _randomise_parallel_or_update(
+    papers, stratifying_name, seed_sequence, update=True, count=1, workers=1
+):
+    df = datasets.values_frame(papers, "pmid", stratifying_name)
     df.sort_values(by="pmid", inplace=True)
-    with Pool(2) as pool:
-        res = pool.map(
-            partial(_randomise, stratifying_name=stratifying_name),
-            count * [df],
-        )
+    logging.info(f"Randomising {stratifying_name} {count} times")
+    allocations = _randomise(df, stratifying_name, seed_sequence, count, workers)
     if count == 1 and update:
         logging.info("Updating database with randomisation")
-        s = res[0]
-        intervention = list(s[s == "i"].index)
-        control = list(s[s == "c"].index)
+        intervention = list(df.pmid[allocations[0] == allocation.INTERVENTION])
+        control = list(df.pmid[allocations[0] == allocation.CONTROL])
         RetractedPaper.objects.filter(pmid__in=intervention).update(rct_group="i")
         RetractedPaper.objects.filter(pmid__in=control).update(rct_group="c")
     elif update:
@@ -349,43 +403,49 @@ def _randomise_parallel_or_update(papers, stratifying_name, update=True, count=1
         )
         return
 
-    randomisations = pandas.concat(
-        res,
-        axis=1,
-        keys=[f"trt_{stratifying_name}_{index}" for index in range(count)],
+    randomisations = pandas.DataFrame(
+        allocations.T,
+        index=df.pmid,
+        columns=[f"trt_{stratifying_name}_{index}" for index in range(count)],
     )
     return randomisations
 
 
-def _compute_contamination():
+def contaminated_authors():
     """
-    Get pmids of any papers that had a contactable author in both groups at
-    time of randomisation
+    Authors contactable at the time of randomisation about papers in both
+    the intervention and control groups
     """
-    intervention_authors = (
-        CitationRetractionPair.objects.filter(citingpaper__cited_in_rct=True)
-        .filter(retractedpaper__rct_group="i")
-        .values_list("contactable_authors", flat=True)
-    )
-    logging.info("Got intervention authors")
-    control_authors = (
-        CitationRetractionPair.objects.filter(citingpaper__cited_in_rct=True)
-        .filter(retractedpaper__rct_group="c")
-        .values_list("contactable_authors", flat=True)
+    return (
+        Author.objects.filter(
+            pairs__citingpaper__cited_in_rct=True,
+            pairs__retractedpaper__rct_group__in=["i", "c"],
+        )
+        .values("pk")
+        .annotate(rct_groups=Count("pairs__retractedpaper__rct_group", distinct=True))
+        .filter(rct_groups__gt=1)
+        .values("pk")
     )
-    logging.info("Got control authors")
-    contaminated_authors = set(intervention_authors).intersection(set(control_authors))
-    return set(
-        CitationRetractionPair.objects.filter(citingpaper__cited_in_rct=True)
-        .filter(Q(retractedpaper__rct_group="i") | Q(retractedpaper__rct_group="c"))
-        .filter(contactable_authors__in=contaminated_authors)
-        .values_list("retractedpaper__pmid", flat=True)
+
+
+def _contaminated():
+    """
+    Whether a paper had a contactable author in both groups at time of
+    randomisation
+    """
+    return Exists(
+        CitationRetractionPair.objects.filter(
+            retractedpaper=OuterRef("pk"),
+            citingpaper__cited_in_rct=True,
+            contactable_authors__in=contaminated_authors(),
+        )
     )
 
 
 def gen_dataset(options):
     follow_up_date = options["follow_up_date"]
     output_file = options["output_file"]
+    call_command("update_paper_summaries")
     papers = RetractedPaper.objects.filter(
         Q(rct_group="i") | Q(rct_group="c")
     ).annotate(
@@ -405,28 +465,32 @@ def gen_dataset(options):
         raise EmptyResultSet("No randomised retracted papers found")
     papers = _annotate_count_unique(papers)
     papers = _annotate_strata(papers, "groups", manual_cuts, update=True)
-    papers = papers.annotate(earliest_notice=Min("notices__comparisondate__year"))
+    papers = papers.annotate(
+        earliest_notice=F("summary__earliest_notice_year"),
+        contaminated=_contaminated(),
+    )
     logging.info("Annoted notice date")
     logging.info("Getting dataframe")
-    # TODO: translate c/i to 0/1
-    df = pandas.DataFrame(
-        papers.values(
-            "pmid",
-            "rct_group",
-            "stratifying_group",
-            "citation_count",
-            "count_unique",
-            "comparisondate__year",
-            "earliest_notice",
-        )
+    df = datasets.values_frame(
+        papers,
+        "pmid",
+        "rct_group",
+        "stratifying_group",
+        "citation_count",
+        "count_unique",
+        "comparisondate__year",
+        "earliest_notice",
+        "contaminated",
     )
+    df["rct_group"] = numpy.where(
+        df.rct_group == "i", allocation.INTERVENTION, allocation.CONTROL
+    ).astype(numpy.int8)
     logging.info("Got dataframe")
     df["years_since_retraction"] = follow_up_date.year - df["earliest_notice"]
     df["years_since_publication"] = follow_up_date.year - df["comparisondate__year"]
-    pmids = _compute_contamination()
     df = df.set_index("pmid")
-    df["contaminated"] = df.index.isin(pmids)
-    df.to_csv(output_file)
+    df["contaminated"] = df.pop("contaminated")
+    datasets.write_dataset(df, output_file, options["format"], treatment=["rct_group"])
 
 
 class Command(BaseCommand):
@@ -452,6 +516,11 @@ class Command(BaseCommand):
             action="store_true",
             help="Print table1 to spot check randomisation",
         )
+        randomisation_parser.add_argument(
+            "--seed",
+            type=int,
+            help="Seed to reproduce a randomisation, which is random by default",
+        )
         simulation_parser = subparsers.add_parser("simulate", help="Run simulation")
         simulation_parser.set_defaults(func=gen_simulation)
         simulation_parser.add_argument(
@@ -472,6 +541,23 @@ class Command(BaseCommand):
             default=500,
             help="Number of randomisations",
         )
+        simulation_parser.add_argument(
+            "--seed",
+            type=int,
+            help="Seed to reproduce simulations, which are random by default",
+        )
+        simulation_parser.add_argument(
+            "--format",
+            choices=datasets.FORMATS,
+            default="csv",
+            help="Simulation dataset file format",
+        )
+        simulation_parser.add_argument(
+            "--workers",
+            type=pos_int,
+            default=1,
+            help="Number of processes to run simulations in",
+        )
         dataset_parser = subparsers.add_parser(
             "gen_dataset", help="Generate analysis dataset"
         )
@@ -488,6 +574,12 @@ class Command(BaseCommand):
             required=True,
             help="Analysis dataset filename",
         )
+        dataset_parser.add_argument(
+            "--format",
+            choices=datasets.FORMATS,
+            default="csv",
+            help="Analysis dataset file format",
+        )
 
     def handle(self, *args, **options):
         setup.setup_logger(options["verbosity"])
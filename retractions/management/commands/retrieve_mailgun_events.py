@@ -1,11 +1,93 @@
 import datetime
+import hashlib
+import json
 import logging
+import time
 
 import requests
 from django.core.management.base import BaseCommand
+from django.db import connection
 
 from common import setup
-from retractions.models import MailSent
+from retractions.models import MailgunEvent, MailgunEventCursor, MailSent
+
+
+# Mailgun keeps events for 30 days
+RETENTION = datetime.timedelta(days=30)
+
+# Events which set the MailSent field of the same name to the earliest such
+# event
+EARLIEST_EVENTS = ["accepted", "delivered", "opened", "unsubscribed"]
+
+# Summary field on MailSent for each response link clicked, set to the latest
+# click, in the order the links are checked against the URL; any other link
+# counts as clicked_other
+CLICKED_FIELDS = [
+    ("didntknowany", "clicked_didntknowany"),
+    ("alreadyknewall", "clicked_alreadyknewall"),
+    ("alreadyknewsome", "clicked_alreadyknewsome"),
+]
+
+
+def rollup_sql():
+    """
+    SQL to update the summary times on MailSent from the stored events, with
+    its parameters other than the update time and an optional WHERE clause
+    on the events
+    """
+    aggregates = [
+        f"MIN(timestamp) FILTER (WHERE event = '{event}') AS {event}"
+        for event in EARLIEST_EVENTS
+    ]
+    params = []
+    earlier_links = []
+    for link, field in CLICKED_FIELDS + [(None, "clicked_other")]:
+        condition = "event = 'clicked' AND url IS NOT NULL"
+        for earlier in earlier_links:
+            condition += " AND url NOT LIKE %s"
+            params.append(f"%{earlier}%")
+        if link is not None:
+            condition += " AND url LIKE %s"
+            params.append(f"%{link}%")
+            earlier_links.append(link)
+        aggregates.append(f"MAX(timestamp) FILTER (WHERE {condition}) AS {field}")
+
+    # LEAST and GREATEST ignore nulls, and keep times from events which
+    # Mailgun had already deleted before they were stored
+    fields = [(event, "LEAST") for event in EARLIEST_EVENTS] + [
+        (field, "GREATEST") for _, field in CLICKED_FIELDS + [(None, "clicked_other")]
+    ]
+    assignments = ",\n".join(
+        f"{field} = {function}(mail_sent.{field}, e.{field})"
+        for field, function in fields
+    )
+    changed = "\nOR ".join(
+        f"mail_sent.{field} IS DISTINCT FROM {function}(mail_sent.{field}, e.{field})"
+        for field, function in fields
+    )
+    sql = f"""
+        UPDATE mail_sent SET
+        {assignments},
+        updated_at = %s
+        FROM (
+            SELECT message_id, {", ".join(aggregates)}
+            FROM mailgun_event
+            {{where}}
+            GROUP BY message_id
+        ) e
+        WHERE mail_sent.message_id = e.message_id
+        AND ({changed})
+        """
+    return sql, params
+
+
+def event_id(item):
+    """
+    Mailgun's id for an event, or a hash of the event if it has none
+    """
+    if item.get("id"):
+        return item["id"]
+    return hashlib.sha1(json.dumps(item, sort_keys=True).encode()).hexdigest()
 
 
 class Command(BaseCommand):
@@ -14,18 +96,54 @@ class Command(BaseCommand):
     NB: Mailgun only retains information for 30 days, so we need to
     run this script at least that often."""  # noqa: A003
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--overlap",
+            type=int,
+            default=30,
+            help="Minutes before the latest event already processed to ask "
+            "for events from, to catch events Mailgun stored late",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Ask for all the events Mailgun still has, rather than only "
+            "those since the last run",
+        )
+        parser.add_argument(
+            "--rollup-only",
+            action="store_true",
+            help="Update the times on every mail sent from the events already "
+            "stored, without asking Mailgun for more",
+        )
+
     def handle(self, *args, **options):
         setup.setup_logger(options["verbosity"])
 
+        if options["rollup_only"]:
+            updated = self._rollup()
+            logging.info("Updated %d mails sent", updated)
+            return
+
         MAILGUN_API_KEY = setup.get_env_setting("RETR_MAILGUN_API_KEY")
 
-        # Get all events available
+        # Get the events since the last run, oldest first, or all available
+        # on the first run
+        cursor = MailgunEventCursor.objects.first()
+        if cursor is None or options["full"]:
+            begin = time.time() - RETENTION.total_seconds()
+        else:
+            begin = cursor.timestamp - options["overlap"] * 60
+        logging.info(
+            "Getting events since %s", datetime.datetime.utcfromtimestamp(begin)
+        )
         url = "https://api.eu.mailgun.net/v3/retracted.net/events"
+        params = {"begin": begin, "ascending": "yes"}
 
         # Loop through pages of events
         while True:
             logging.info("Getting Mailgun URL: %s", url)
-            resp = requests.get(url, auth=("api", MAILGUN_API_KEY))
+            resp = requests.get(url, params=params, auth=("api", MAILGUN_API_KEY))
             resp.raise_for_status()
             data = resp.json()
             items = data["items"]
@@ -33,94 +151,90 @@ class Command(BaseCommand):
             if len(items) == 0:
                 break
 
-            # Loop through them
-            for i in list(items):
-                event = i["event"]
-                try:
-                    message_id = i["message"]["headers"]["message-id"]
-                except KeyError:
-                    logging.warning(f"{i['event']} has no message id, skipped")
-                    continue
-                when = datetime.datetime.utcfromtimestamp(i["timestamp"])
-                url = None
-                if event == "clicked":
-                    if "url" not in i:
-                        logging.warning("No URL in clicked event")
-                        continue
-                    url = i["url"]
-
-                try:
-                    mail_sent = MailSent.objects.get(message_id=message_id)
-                except MailSent.DoesNotExist:
-                    logging.warning(
-                        "Message not found in our sent database: %s %s %s %s",
-                        message_id,
-                        event,
-                        when,
-                        url,
-                    )
-                    continue
-                logging.info(
-                    "Processing event: %s %s %s %s",
-                    message_id,
-                    event,
-                    when,
-                    url,
-                )
+            message_ids = self._store_page(items)
+            updated = self._rollup(message_ids)
+            logging.info("Updated %d mails sent", updated)
 
-                if event == "accepted":
-                    # take earliest accepted event
-                    if not mail_sent.accepted or when < mail_sent.accepted:
-                        mail_sent.accepted = when
-                elif event == "delivered":
-                    # take earliest delivered event
-                    if not mail_sent.delivered or when < mail_sent.delivered:
-                        mail_sent.delivered = when
-                elif event == "opened":
-                    # take earliest delivered event
-                    if not mail_sent.opened or when < mail_sent.opened:
-                        mail_sent.opened = when
-                elif event == "unsubscribed":
-                    # take earliest unsubscribed event
-                    if not mail_sent.unsubscribed or when < mail_sent.unsubscribed:
-                        mail_sent.unsubscribed = when
-                elif event == "clicked":
-                    if "didntknowany" in url:
-                        # take latest click event
-                        if (
-                            not mail_sent.clicked_didntknowany
-                            or when > mail_sent.clicked_didntknowany
-                        ):
-                            mail_sent.clicked_didntknowany = when
-                    elif "alreadyknewall" in url:
-                        # take latest click event
-                        if (
-                            not mail_sent.clicked_alreadyknewall
-                            or when > mail_sent.clicked_alreadyknewall
-                        ):
-                            mail_sent.clicked_alreadyknewall = when
-                    elif "alreadyknewsome" in url:
-                        # take latest click event
-                        if (
-                            not mail_sent.clicked_alreadyknewsome
-                            or when > mail_sent.clicked_alreadyknewsome
-                        ):
-                            mail_sent.clicked_alreadyknewsome = when
-                    else:
-                        # take latest click event
-                        if (
-                            not mail_sent.clicked_other
-                            or when > mail_sent.clicked_other
-                        ):
-                            mail_sent.clicked_other = when
-                elif event == "failed":
-                    continue
-                else:
-                    logging.warning("Unknown event '%s'" % event)
-
-                mail_sent.save()
+            # Record how far we've got, so the next run (or this one again,
+            # if it is interrupted) carries on from here
+            latest = max(items, key=lambda i: i["timestamp"])
+            if cursor is None:
+                cursor = MailgunEventCursor(timestamp=latest["timestamp"])
+            if latest["timestamp"] >= cursor.timestamp:
+                cursor.timestamp = latest["timestamp"]
+                cursor.event_id = latest.get("id")
+                cursor.save()
 
             paging = data["paging"]
             if "next" not in paging:
                 break
+            # The next page URL carries on the same query
             url = paging["next"]
+            params = None
+
+    def _store_page(self, items):
+        """
+        Store a page of events, skipping any already stored, returning the
+        message ids they are about
+        """
+        events = []
+        for i in items:
+            event = i["event"]
+            try:
+                message_id = str(i["message"]["headers"]["message-id"])
+            except KeyError:
+                logging.warning(f"{i['event']} has no message id")
+                message_id = None
+            when = datetime.datetime.utcfromtimestamp(i["timestamp"])
+            url = i.get("url")
+            if event == "clicked" and url is None:
+                logging.warning("No URL in clicked event")
+            elif event not in EARLIEST_EVENTS + ["clicked", "failed"]:
+                logging.warning("Unknown event '%s'" % event)
+            logging.info(
+                "Processing event: %s %s %s %s",
+                message_id,
+                event,
+                when,
+                url,
+            )
+            events.append(
+                MailgunEvent(
+                    event_id=event_id(i),
+                    event=event,
+                    message_id=message_id,
+                    timestamp=when,
+                    url=url,
+                    data=i,
+                )
+            )
+        MailgunEvent.objects.bulk_create(events, ignore_conflicts=True)
+
+        message_ids = {e.message_id for e in events if e.message_id is not None}
+        found = set(
+            MailSent.objects.filter(message_id__in=message_ids).values_list(
+                "message_id", flat=True
+            )
+        )
+        for message_id in sorted(message_ids - found):
+            logging.warning("Message not found in our sent database: %s", message_id)
+        return sorted(found)
+
+    def _rollup(self, message_ids=None):
+        """
+        Update the times on the mails sent with message_ids, or on all of
+        them, from the stored events, returning how many changed
+        """
+        sql, params = rollup_sql()
+        if message_ids is None:
+            sql = sql.format(where="")
+        else:
+            if not message_ids:
+                return 0
+            sql = sql.format(where="WHERE message_id = ANY(%s)")
+            params = params + [list(message_ids)]
+        # bulk updates don't touch auto_now fields
+        params = [datetime.datetime.now()] + params
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
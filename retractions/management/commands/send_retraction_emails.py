@@ -1,23 +1,55 @@
+import datetime
 import email.utils
+import itertools
 import logging
-import mailbox
 import pathlib
+import threading
+import time
+from concurrent import futures
 
 import anymail.exceptions
-import anymail.utils
 import django.core.exceptions
 import django.db
-import html2text
 import pandas
 from django.core.mail import EmailMultiAlternatives
 from django.core.management.base import BaseCommand
+from django.db.models import F, FloatField, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Cast
 
 from common import setup
-from retractions.models import Author, CitingPaper, MailSent
+from retractions import emails, mail_archive
+from retractions.models import (
+    Author,
+    AuthorAlias,
+    CitationRetractionPair,
+    MailOutbox,
+    MailSent,
+)
 
 
-text_maker = html2text.HTML2Text()
-text_maker.links_each_paragraph = True
+FROM_EMAIL = '"The RetractoBot Team, University of Oxford" <team@retracted.net>'
+# Rows of the email validation results to read at a time
+UNDELIVERABLE_CHUNK_SIZE = 100_000
+
+
+class RateLimiter:
+    """
+    Space out calls to wait(), across threads, to at most rate a second
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        time.sleep(at - now)
 
 
 class OurEmail(EmailMultiAlternatives):
@@ -66,15 +98,57 @@ class Command(BaseCommand):
             type=pathlib.Path,
             help="File with validation result",
         )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=100,
+            help="Number of authors to load, and claim for sending, at a time",
+        )
+        parser.add_argument(
+            "--phase",
+            choices=["prepare", "deliver", "all"],
+            default="all",
+            help="In a live run, prepare mails in the outbox, deliver mails from "
+            "the outbox, or (default) both",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of senders to run at once",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            help="Maximum number of mails to send a second",
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=3,
+            help="Number of times to try sending a mail Mailgun refuses in one run",
+        )
+        parser.add_argument(
+            "--requeue-pending",
+            action="store_true",
+            help="Send again to authors claimed by a sender which didn't finish, "
+            "once the Mailgun logs show they weren't mailed",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=60,
+            help="Minutes after which a sender which claimed authors, but "
+            "didn't record them as sent, is taken not to have finished",
+        )
 
     def handle(self, *args, **options):
         setup.setup_logger(options["verbosity"])
         if options["live-run"]:
-            self.mb = mailbox.mbox("live-all-sent-mails.mbox")
+            self.archive = mail_archive.MailArchive("live-all-sent-mails")
         else:
-            self.mb = mailbox.mbox("debug-last-sent-mails.mbox")
-            self.mb.clear()
-            self.mb.flush()
+            self.archive = mail_archive.MailArchive("debug-last-sent-mails")
+            self.archive.clear()
 
         if options["live-run"]:
             self.live_run = True
@@ -84,54 +158,355 @@ class Command(BaseCommand):
             logging.info("Dry run - not actually sending emails")
 
         self.test_email = options["test-email"]
+        self.concurrency = options["concurrency"]
+        self.chunk_size = options["chunk_size"]
 
         if options["undeliverable_file"]:
             self.undeliverable = self._get_undeliverable(options["undeliverable_file"])
         else:
             self.undeliverable = None
 
-        # Filter for the authors who we would send mail to
-        authors = (
+        limit = int(options["limit"]) if options["limit"] else None
+        if self.live_run:
+            self._reconcile(options["requeue_pending"], options["stale_after"])
+            if options["phase"] in ["prepare", "all"]:
+                self._prepare(limit)
+            if options["phase"] in ["deliver", "all"]:
+                self._deliver(limit, options["rate"], options["max_attempts"])
+            return
+
+        # Dry run, writing the mails which would be sent to the debug archive
+        for mails in self._composed_chunks(self._due_authors(), limit):
+            for author, mail_to_send in mails:
+                self._archive_mail(mail_to_send, author.auid)
+            logging.warning("  Dry run, not *actually* sent")
+
+    def _due_authors(self):
+        """
+        Filter for the authors who we would send mail to
+        """
+        return (
             Author.objects.filter(pairs__retractedpaper__rct_group="i")
             .filter(mail_sent__isnull=True)
-            .extra(select={"auid_float": "auid::float"})
-            .order_by("auid_float")
+            .exclude(
+                outbox__status__in=[
+                    MailOutbox.Status.PENDING,
+                    MailOutbox.Status.SENT,
+                ]
+            )
         ).distinct()
-        if options["limit"]:
-            authors = authors[: int(options["limit"])]
-        logging.info("Total authors to send %d", len(authors))
-        # Could also add info about the pairs
-        for author in authors:
-            logging.info(
-                "Author: AUID %s",
-                author.auid,
+
+    def _composed_chunks(self, authors, limit=None):
+        """
+        Compose the mails to up to limit authors in AUID order, yielding
+        them a chunk at a time
+        """
+        authors = authors.extra(select={"auid_float": "auid::float"}).order_by(
+            "auid_float"
+        )
+        if limit:
+            authors = authors[:limit]
+        logging.info("Total authors to send %d", authors.count())
+        authors = self._with_mail_data(authors).iterator(chunk_size=self.chunk_size)
+        while chunk := list(itertools.islice(authors, self.chunk_size)):
+            yield self._compose(chunk)
+
+    def _with_mail_data(self, authors):
+        """
+        Load everything needed to write the mails a chunk of authors at a
+        time, rather than querying per author, pair and paper
+        """
+        return authors.prefetch_related(
+            Prefetch(
+                "pairs",
+                queryset=CitationRetractionPair.objects.filter(
+                    retractedpaper__rct_group="i"
+                )
+                .select_related("citingpaper", "retractedpaper")
+                .prefetch_related("retractedpaper__notices")
+                .order_by("pk"),
+                to_attr="intervention_pairs",
+            ),
+            Prefetch("author_aliases", queryset=AuthorAlias.objects.order_by("pk")),
+            "mail_sent__pairs",
+        )
+
+    def _reconcile(self, requeue_pending, stale_after=60):
+        """
+        Tidy up the outbox after senders which didn't finish. Authors claimed
+        less than stale_after minutes ago are left alone, as their sender may
+        still be running
+        """
+        now = datetime.datetime.now()
+        pending = MailOutbox.objects.filter(status=MailOutbox.Status.PENDING)
+        # Mails recorded as sent, but not in the outbox
+        MailOutbox.objects.exclude(status=MailOutbox.Status.SENT).filter(
+            author__mail_sent__isnull=False
+        ).update(
+            status=MailOutbox.Status.SENT,
+            mail_sent=Subquery(
+                MailSent.objects.filter(author=OuterRef("author")).values("pk")[:1]
+            ),
+            to=[],
+            body_html="",
+            body_text="",
+            updated_at=now,
+        )
+        # Mailgun refused these last time, so try again
+        MailOutbox.objects.filter(status=MailOutbox.Status.FAILED).update(
+            status=MailOutbox.Status.QUEUED, attempts=0, updated_at=now
+        )
+        # Whether these were mailed isn't known, so they are only sent again
+        # when asked to
+        pending = pending.filter(
+            Q(claimed_at__isnull=True)
+            | Q(claimed_at__lt=now - datetime.timedelta(minutes=stale_after))
+        )
+        auids = list(pending.values_list("author__auid", flat=True))
+        if not auids:
+            return
+        if requeue_pending:
+            logging.warning(
+                "Sending again to %d authors claimed by a sender which didn't finish",
+                len(auids),
+            )
+            pending.update(status=MailOutbox.Status.QUEUED, attempts=0, updated_at=now)
+        else:
+            logging.warning(
+                "Not sending to %d authors claimed by a sender which didn't "
+                "finish, as they may have been mailed. Check the Mailgun logs, "
+                "then use --requeue-pending to send to them. AUIDs: %s",
+                len(auids),
+                ",".join(auids),
             )
 
-            self._send_for_author(author)
+    def _prepare(self, limit=None):
+        """
+        Render the mails for authors who are due one into the outbox, in bulk
+        """
+        prepared = 0
+        authors = self._due_authors().filter(outbox__isnull=True)
+        for mails in self._composed_chunks(authors, limit):
+            with django.db.transaction.atomic():
+                # Another process preparing at the same time may have queued
+                # mails to some of these authors already, so keep those
+                MailOutbox.objects.bulk_create(
+                    [
+                        MailOutbox(
+                            author=author,
+                            subject=mail_to_send.subject,
+                            body_html=mail_to_send.alternatives[0][0],
+                            body_text=mail_to_send.body,
+                            to=mail_to_send.to,
+                            recentest_citing_paper_id=str(
+                                mail_to_send.recentest_citing_paper_id
+                            ),
+                        )
+                        for author, mail_to_send in mails
+                    ],
+                    ignore_conflicts=True,
+                )
+                # Mails queued by other processes are committed with their
+                # pairs, so those without any are the ones created here
+                outboxes = dict(
+                    MailOutbox.objects.filter(
+                        author__in=[author for author, _ in mails],
+                        pairs__isnull=True,
+                    ).values_list("author_id", "pk")
+                )
+                MailOutbox.pairs.through.objects.bulk_create(
+                    [
+                        MailOutbox.pairs.through(
+                            mailoutbox_id=outboxes[author.pk],
+                            citationretractionpair_id=pair.pk,
+                        )
+                        for author, mail_to_send in mails
+                        if author.pk in outboxes
+                        for pair in mail_to_send.pairs
+                    ],
+                    ignore_conflicts=True,
+                )
+            prepared += len(outboxes)
+        logging.info("Prepared %d mails", prepared)
 
-    def _get_undeliverable(self, results_path):
-        results_df = pandas.read_csv(results_path)
-        assert "result" in results_df.columns
-        undeliverable = results_df[
-            (results_df.result == "undeliverable")
-            | (results_df.result == "do_not_send")
-        ]
-        return undeliverable.address
+    def _deliver(self, limit=None, rate=None, max_attempts=3):
+        """
+        Send the mails queued in the outbox, at up to rate a second
+        """
+        self.remaining = limit
+        self.claim_lock = threading.Lock()
+        self.rate_limiter = RateLimiter(rate)
+        self.max_attempts = max_attempts
+        queued = MailOutbox.objects.filter(status=MailOutbox.Status.QUEUED).count()
+        logging.info("Total mails to deliver %d", min(queued, limit or queued))
+        if self.concurrency == 1:
+            self._send_queued()
+        else:
+            with futures.ThreadPoolExecutor(self.concurrency) as pool:
+                senders = [
+                    pool.submit(self._send_queued_in_thread)
+                    for _ in range(self.concurrency)
+                ]
+                for sender in senders:
+                    sender.result()
+
+    def _send_queued_in_thread(self):
+        try:
+            self._send_queued()
+        finally:
+            django.db.connection.close()
 
-    def _send_for_author(self, author):
+    def _send_queued(self):
         """
-        Create and send mails for the author.
+        Claim chunks of queued mails and send them, until none are left
         """
+        while claimed := self._claim():
+            self._send_claimed(claimed)
 
-        intervention_pairs = author.pairs.filter(retractedpaper__rct_group="i")
-        mail_to_send = self._get_mail_to_send(author, intervention_pairs)
-        # Check we have emails to send
-        if not mail_to_send:
-            logging.info("  Sending no mails as none due to send")
-            return
+    def _claim(self):
+        """
+        Mark a chunk of queued mails as pending, in AUID order. Rows locked
+        by other senders are skipped, so each mail is claimed only once
+        """
+        with self.claim_lock:
+            size = self.chunk_size
+            if self.remaining is not None:
+                size = min(size, self.remaining)
+            if size == 0:
+                return []
+            now = datetime.datetime.now()
+            with django.db.transaction.atomic():
+                claimed = list(
+                    MailOutbox.objects.select_for_update(skip_locked=True, of=("self",))
+                    .select_related("author")
+                    .filter(status=MailOutbox.Status.QUEUED)
+                    .order_by(Cast("author__auid", FloatField()), "pk")[:size]
+                )
+                MailOutbox.objects.filter(pk__in=[c.pk for c in claimed]).update(
+                    status=MailOutbox.Status.PENDING,
+                    claimed_at=now,
+                    attempts=F("attempts") + 1,
+                    updated_at=now,
+                )
+            if self.remaining is not None:
+                self.remaining -= len(claimed)
+            return claimed
+
+    def _send_claimed(self, claimed):
+        """
+        Send and record a chunk of claimed mails.
+        """
+        pair_ids = {}
+        for outbox_id, pair_id in MailOutbox.pairs.through.objects.filter(
+            mailoutbox__in=claimed
+        ).values_list("mailoutbox_id", "citationretractionpair_id"):
+            pair_ids.setdefault(outbox_id, []).append(pair_id)
+        mails = []
+        for outbox in claimed:
+            logging.info("Mail to author %s: %s", outbox.author_id, ",".join(outbox.to))
+            mail_to_send = self._outbox_mail(outbox)
+            mail_to_send.pairs = pair_ids.get(outbox.pk, [])
+            mails.append((outbox, mail_to_send))
+
+        # Nothing is sent until the checks pass, so all of them are queued
+        # again if they fail
+        unsent = [outbox.pk for outbox in claimed]
+        try:
+            # Double check these authors haven't already been mailed
+            # Each author should have only one set of pairs
+            assert not MailSent.objects.filter(
+                author__in=[outbox.author_id for outbox in claimed]
+            ).exists()
+
+            # Send using Django's anymail (which for production setups will
+            # go via MailGun). Each mail is recorded as soon as it is sent, so
+            # a sender which stops leaves at most one mail whose sending
+            # isn't known
+            for i, (outbox, mail_to_send) in enumerate(mails):
+                # Mails this sender won't get to are queued again
+                unsent = [later.pk for later, _ in mails[i + 1 :]]
+                self.rate_limiter.wait()
+                error = self._send_mail(mail_to_send)
+                if error:
+                    self._record_mail_failed(outbox, error)
+                else:
+                    self._record_mail_sent(outbox, mail_to_send)
+                    self._archive_mail(
+                        mail_to_send,
+                        outbox.author.auid,
+                        str(mail_to_send.anymail_status.message_id),
+                    )
+        except django.db.utils.Error as e:
+            logging.exception("  Database error while mailing: %s", str(e))
+            self._release(unsent)
+            raise
+        except BaseException:
+            self._release(unsent)
+            raise
+
+    def _release(self, outbox_ids):
+        """
+        Queue again claimed mails which weren't sent
+        """
+        try:
+            MailOutbox.objects.filter(
+                pk__in=outbox_ids, status=MailOutbox.Status.PENDING
+            ).update(
+                status=MailOutbox.Status.QUEUED,
+                attempts=F("attempts") - 1,
+                updated_at=datetime.datetime.now(),
+            )
+        except django.db.utils.Error as e:
+            logging.exception("  Database error releasing unsent mails: %s", str(e))
 
-        # Send the mails
-        self._actually_send_mails(author, intervention_pairs, mail_to_send)
+    def _outbox_mail(self, outbox):
+        msg = OurEmail(
+            subject=outbox.subject,
+            body=outbox.body_text,
+            from_email=FROM_EMAIL,
+            to=outbox.to,
+        )
+        msg.attach_alternative(outbox.body_html, "text/html")
+        msg.track_clicks = True
+        msg.recentest_citing_paper_id = outbox.recentest_citing_paper_id
+        return msg
+
+    def _get_undeliverable(self, results_path):
+        """
+        Lowercased set of the addresses the validation results say not to
+        mail, read a chunk of rows at a time so large exports fit in memory
+        """
+        undeliverable = set()
+        for results_df in pandas.read_csv(
+            results_path,
+            usecols=["address", "result"],
+            dtype=str,
+            chunksize=UNDELIVERABLE_CHUNK_SIZE,
+        ):
+            rows = results_df[results_df.result.isin(["undeliverable", "do_not_send"])]
+            undeliverable.update(rows.address.dropna().str.strip().str.lower())
+        logging.info("Loaded %d undeliverable addresses", len(undeliverable))
+        return frozenset(undeliverable)
+
+    def _compose(self, authors):
+        """
+        Create the mails for a chunk of authors.
+        """
+
+        mails_to_send = []
+        # Could also add info about the pairs
+        for author in authors:
+            logging.info(
+                "Author: AUID %s",
+                author.auid,
+            )
+            mail_to_send = self._get_mail_to_send(author, author.intervention_pairs)
+            # Check we have emails to send
+            if not mail_to_send:
+                logging.info("  Sending no mails as none due to send")
+                continue
+            mails_to_send.append((author, mail_to_send))
+        return mails_to_send
 
     def _get_mail_to_send(self, author, intervention_pairs):
         """
@@ -140,7 +515,7 @@ class Command(BaseCommand):
         already sent.
         """
 
-        if intervention_pairs.count() == 0:
+        if len(intervention_pairs) == 0:
             logging.info("  Skipping emailing author not in any intervention pairs")
             return
         # have we already sent to this author?
@@ -158,20 +533,20 @@ class Command(BaseCommand):
         # Find unique list of to email addresses we have for that author
         for author_alias in author.author_aliases.all():
             if author_alias.email_address:
-                # see if the mail is valid according to anymail
-                valid = True
-                try:
-                    anymail.utils.parse_single_address(author_alias.email_address)
-                except anymail.exceptions.AnymailInvalidAddress:
+                # see if the mail is valid according to anymail, using the
+                # verdict stored on the alias if it has been checked
+                valid = author_alias.email_valid
+                if valid is None:
+                    valid = author_alias.check_email_valid()
+                if not valid:
                     logging.info(
                         "  Ignoring invalid email %s",
                         author_alias.email_address,
                     )
-                    valid = False
 
                 if (
                     self.undeliverable is not None
-                    and author_alias.email_address in self.undeliverable.values
+                    and author_alias.email_address.strip().lower() in self.undeliverable
                 ):
                     logging.warning(
                         "  Ignoring undeliverable email %s",
@@ -222,193 +597,95 @@ class Command(BaseCommand):
         return mail_to_send
 
     def _generate_mail(self, pairs, author, to_emails):
-        pairs = pairs.order_by("-citingpaper__comparisondate")
-        recentest_citing_paper = pairs.first().citingpaper
-        subject, body = self._get_body_and_subject(
-            pairs, recentest_citing_paper, author
-        )
-        body_plaintext = text_maker.handle(body).strip()
+        context = emails.context(author, pairs)
+        subject, body_html, body_text = emails.render(context)
         msg = OurEmail(
             subject=subject,
-            body=body_plaintext,
-            from_email='"The RetractoBot Team, University of Oxford" <team@retracted.net>',
+            body=body_text,
+            from_email=FROM_EMAIL,
             to=to_emails,
         )
-        msg.attach_alternative(body, "text/html")
+        msg.attach_alternative(body_html, "text/html")
         msg.track_clicks = True
-        msg.recentest_citing_paper_id = recentest_citing_paper.scopus_id
+        msg.recentest_citing_paper_id = context["recentest_citing_paper"].scopus_id
         msg.pairs = pairs
         return msg
 
-    # TODO: check that comparison date is not null
-    def _get_body_and_subject(self, pairs, recentest_citing_paper, author):
-        subject = (
-            "RetractoBot: You cited a retracted paper "
-            f"in your {recentest_citing_paper.journalname} paper published in {recentest_citing_paper.comparisondate.year}"
-        )
-
-        aliases = author.author_aliases.all()
-        assert len(aliases) > 0
-
-        # Introduction.
-        body = "<p>Dear %s,</p>" % aliases[0].full_name()
-        body += "<p>"
-        body += """We're writing to let you know that the following paper(s) cited a
-                paper which has been retracted.<br>Please note, we are
-                interested in reducing future citations of retracted papers, so
-                your citation may have happened before or after the paper was
-                retracted."""
-        body += "</p>"
-        body += "<table border='1' cellpadding='0' cellspacing='0' width='80%' style='border-collapse: collapse;'>"
-        body += "<tr>"
-        body += "<th style='padding: 8px; text-align: left;'>Citing Paper</th>"
-        body += "<th style='padding: 8px; text-align: left;'>Retracted Citation</th>"
-        body += "</tr>"
-        # Use order_by and distinct to preserve order
-        citing_papers = list(
-            pairs.order_by("-citingpaper__scopus_id")
-            .values_list("citingpaper__scopus_id", flat=True)
-            .distinct()
-        )
-        # Just need count so we don't need to preserve order (can use a set)
-        total_papers = len(set(pairs.values_list("retractedpaper__pmid", flat=True)))
-        for scopus_id in citing_papers:
-            citing_paper = CitingPaper.objects.get(scopus_id=scopus_id)
-            body += "<tr>"
-            body += f'<td style="padding: 8px;">"{citing_paper.title}" ({citing_paper.journalname}, {citing_paper.comparisondate.year})</td>'
-            body += "<td style='padding: 8px;'>"
-            body += "<ul>"
-            for pair in pairs.filter(
-                citingpaper__scopus_id=citing_paper.scopus_id
-            ).order_by("-retractedpaper__comparisondate"):
-                retracted_paper = pair.retractedpaper
-                retraction_notice = retracted_paper.get_notice()
-                body += f'<li>"{retracted_paper.title}" ({retracted_paper.journal_iso}, {retracted_paper.comparisondate.year}), which <a href="{retraction_notice.url()}">was retracted in {retraction_notice.comparisondate.year}</a>.</li>'
-            body += "</ul>"
-            body += "</td>"
-            body += "</tr>"
-        body += "</table>"
-        # Collect information about whether the mail was useful.
-        body += """<p>The <a href="https://retracted.net/">RetractoBot</a>
-            research project is a randomised controlled trial (RCT) which
-            aims to see whether sending emails to authors who cited retracted
-            biomedical research papers impacts future citations of retracted
-            papers.</p>
-
-            <p><strong>Was this information useful?</strong><br/>
-            Please click below to let us know <strong>whether you know about
-            the retraction now, not based on when you cited it</strong>.
-
-            <br>Your voluntary click, below, is taken as consent for your
-            response to be included in our aggregated analysis. If you have any
-            other comments, please reply to this email; your voluntary reply is
-            taken as consent for us to include these comments in further
-            qualitative analysis for the project, with identifiable information
-            removed, unless otherwise noted in your response."""
-
-        body += """</p>"""
-        if total_papers > 1:
-            body += """<p><a href="https://retracted.net/response/alreadyknewall">I
-                <strong>already knew ALL</strong> of these papers were
-                retracted, thanks!</a><br/>"""
-            body += """<b>or</b><br>
-                <a href="https://retracted.net/response/alreadyknewsome">I
-                <strong>already knew SOME</strong> of these papers were
-                retracted, thanks!</a><br/>"""
-            body += """<b>or</b><br>
-                <a href="https://retracted.net/response/didntknowany">I
-                <strong>didn't know ANY</strong> of these papers were
-                retracted, thanks!</a>"""
-
-        else:
-            body += """<p><a href="https://retracted.net/response/alreadyknewall">I
-                <strong>already knew this</strong> paper was
-                retracted, thanks!</a><br/>"""
-            body += """<b>or</b><br>
-                <a href="https://retracted.net/response/didntknowany">I
-                <strong>didn't know this</strong> paper was retracted,
-                thanks!</a>"""
-        # Signoff.
-        body += """<p>Many thanks for your time.</p>"""
-        body += """<p>Yours sincerely,<br>The RetractoBot Team
-                <br>(Dr Nicholas DeVito, Christine Cunningham, Seb Bacon,
-                Prof Ben Goldacre)</p>"""
-
-        body += """<p><small><a href="https://www.bennett.ox.ac.uk/">
-            The Bennett Institute for Applied Data Science</a>,
-            <br>Nuffield Department of Primary Care Health Sciences,
-                University of Oxford
-            <br>Radcliffe Observatory Quarter, Woodstock Road, Oxford,
-                OX2 6GG</small></p>"""
-
-        body += """<hr>"""
-
-        body += """<p><small>In accordance with the General Data
-        Protection Regulation (GDPR) we would like to inform you of the
-        following information. We are using publicly accessible bibliographic
-        information from the PubMed and Scopus databases. We are processing
-        only your name and email address associated with your Scopus Author ID,
-        which we obtained from Scopus only to send you this message. The data
-        is processed by Mailgun to send you this email and DigitalOcean to
-        store our dataset, but control of the data is retained by our project
-        team members. Your name and email address will be deleted from our
-        dataset after project completion. <em>If you would like to stop
-        receiving emails from RetractoBot at this email address, choose the
-        'unsubscribe' link below. If you would like to correct your data on
-        PubMed or Scopus, please contact those organisations
-        directly.</em></small></p>"""
-
-        return (subject, body)
-
-    def _actually_send_mails(self, author, pairs, mail_to_send):
-        """
-        Actually send emails, storing via MailSent objects in the
-        database that have done so.
+    def _archive_mail(self, mail_to_send, auid, message_id=None):
+        """
+        Write a message to the mail archive, under the message id Mailgun
+        gave it if it was sent
         """
         try:
-            # Double check this author hasn't already been mailed
-            # Each author should have only one set of pairs
-            assert MailSent.objects.filter(author=author).count() == 0
-
-            # Write message to debug mailbox file
-            self.mb.add(mail_to_send.message())
-            self.mb.flush()
-
-            # Don't do anything if a dry run
-            if not self.live_run:
-                logging.warning("  Dry run, not *actually* sent")
-                return
+            self.archive.add(mail_to_send.message(), message_id=message_id, auid=auid)
+        except UnicodeError as e:
+            logging.exception("  Unicode error trying to archive email: %s", str(e))
+        except OSError as e:
+            logging.exception("  Error trying to archive email: %s", str(e))
 
-            with django.db.transaction.atomic():
-                # Send using Django's anymail (which for production
-                # setups will go via MailGun)
-                ret = mail_to_send.send()
-                # For any errors we should get an exception, so
-                # one mail should always be sent.
-                assert ret == 1
-
-                # Record it was sent in the database
-                (mail_sent, created) = MailSent.objects.get_or_create(author=author)
-                assert created
-                mail_sent.message_id = (
-                    str(mail_to_send.anymail_status.message_id)
-                    .replace("<", "")
-                    .replace(">", "")
-                )
-                mail_sent.to = ",".join(mail_to_send.to)
-                mail_sent.recentest_citing_paper_id = str(
-                    mail_to_send.recentest_citing_paper_id
-                )
-                mail_sent.pairs.set(pairs)
-                mail_sent.save()
-                logging.info(
-                    "  Mail sent via anymail message id %s",
-                    mail_to_send.anymail_status.message_id,
-                )
+    def _send_mail(self, mail_to_send):
+        """
+        Send one mail, returning the error if it wasn't sent
+        """
+        try:
+            ret = mail_to_send.send()
+            # For any errors we should get an exception, so
+            # one mail should always be sent.
+            assert ret == 1
         except anymail.exceptions.AnymailError as e:
             logging.exception("  Error trying to send email: %s", str(e))
+            return str(e) or type(e).__name__
         except UnicodeError as e:
             logging.exception("  Unicode error trying to send email: %s", str(e))
-        except django.db.utils.Error as e:
-            logging.exception("  Database error while mailing: %s", str(e))
-            raise
+            return str(e) or type(e).__name__
+        logging.info(
+            "  Mail sent via anymail message id %s",
+            mail_to_send.anymail_status.message_id,
+        )
+        return None
+
+    def _record_mail_sent(self, outbox, mail_to_send):
+        """
+        Record a mail which was sent in the database, and mark it sent in the
+        outbox
+        """
+        with django.db.transaction.atomic():
+            mail_sent = MailSent.objects.create(
+                author_id=outbox.author_id,
+                message_id=str(mail_to_send.anymail_status.message_id)
+                .replace("<", "")
+                .replace(">", ""),
+                to=",".join(mail_to_send.to),
+                recentest_citing_paper_id=str(mail_to_send.recentest_citing_paper_id),
+            )
+            mail_sent.pairs.set(mail_to_send.pairs)
+            outbox.status = MailOutbox.Status.SENT
+            outbox.mail_sent = mail_sent
+            outbox.error = None
+            # The mail sent is in MailSent and the archive now, so don't keep
+            # another copy of the addresses and names
+            outbox.to = []
+            outbox.body_html = ""
+            outbox.body_text = ""
+            outbox.save(
+                update_fields=[
+                    "status",
+                    "mail_sent",
+                    "error",
+                    "to",
+                    "body_html",
+                    "body_text",
+                    "updated_at",
+                ]
+            )
+
+    def _record_mail_failed(self, outbox, error):
+        """
+        Queue a mail which failed to be tried again, up to max_attempts times
+        """
+        if outbox.attempts + 1 < self.max_attempts:
+            outbox.status = MailOutbox.Status.QUEUED
+        else:
+            outbox.status = MailOutbox.Status.FAILED
+        outbox.error = error
+        outbox.save(update_fields=["status", "error", "updated_at"])
@@ -0,0 +1,51 @@
+import logging
+import mailbox
+import pathlib
+
+from django.core.management import BaseCommand
+
+from retractions import mail_archive
+
+
+class Command(BaseCommand):
+    help = """Show retraction mails from the mail archive, by Mailgun message id
+        or author AUID, or write them to an mbox file to read in a mail client
+        """  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--archive",
+            type=pathlib.Path,
+            default=pathlib.Path("live-all-sent-mails"),
+            help="Mail archive directory, by default that of live runs",
+        )
+        parser.add_argument("--message-id", help="Mailgun message id of the mail")
+        parser.add_argument("--auid", help="AUID of the author mailed")
+        parser.add_argument(
+            "--mbox",
+            type=pathlib.Path,
+            help="Add the mails to this mbox file rather than showing them",
+        )
+
+    def handle(self, *args, **kwargs):
+        archive = mail_archive.MailArchive(kwargs["archive"])
+        messages = [
+            archive.get(entry["message_id"])
+            for entry in archive.entries(
+                message_id=kwargs["message_id"], auid=kwargs["auid"]
+            )
+        ]
+        messages = [message for message in messages if message is not None]
+        if not messages:
+            logging.warning("No archived mails found")
+            return
+
+        if kwargs["mbox"]:
+            mb = mailbox.mbox(kwargs["mbox"])
+            for message in messages:
+                mb.add(message)
+            mb.flush()
+            logging.info(f"Added {len(messages)} mails to {kwargs['mbox']}")
+            return
+        for message in messages:
+            self.stdout.write(message.as_string())
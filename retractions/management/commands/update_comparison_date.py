@@ -1,67 +1,57 @@
+import datetime
 import logging
 
 from django.core.management import BaseCommand
-from django.db.models import Case, When
+from django.db.models import Case, F, Q, When
 
 from retractions.models import CitingPaper, RetractedPaper, RetractionNotice
 
 
+def _update_comparison_date(model, date_fields):
+    """
+    Set comparisondate to the first of date_fields which is set, touching
+    only rows whose comparison date actually changes so that updated_at
+    reflects real changes (contactable_authors relies on it)
+    """
+    new_date = Case(
+        *[When(**{f"{field}__isnull": False}, then=field) for field in date_fields]
+    )
+    changed = (
+        model.objects.alias(new_date=new_date)
+        .filter(
+            Q(comparisondate__lt=F("new_date"))
+            | Q(comparisondate__gt=F("new_date"))
+            | Q(comparisondate__isnull=True, new_date__isnull=False)
+            | Q(comparisondate__isnull=False, new_date__isnull=True)
+        )
+        .values("pk")
+    )
+    return model.objects.filter(pk__in=changed).update(
+        comparisondate=new_date, updated_at=datetime.datetime.now()
+    )
+
+
 class Command(BaseCommand):
     def handle(self, *args, **kwargs):
         logging.info(
             f"Updating comparison date for {RetractedPaper.objects.count()} "
             "retracted papers"
         )
-        RetractedPaper.objects.update(
-            comparisondate=Case(
-                When(
-                    artdate__isnull=False,
-                    then="artdate",
-                ),
-                When(
-                    journaldate__isnull=False,
-                    then="journaldate",
-                ),
-            )
-        )
-        logging.info("Done")
+        n = _update_comparison_date(RetractedPaper, ["artdate", "journaldate"])
+        logging.info(f"Done, {n} changed")
 
         logging.info(
             f"Updating comparison date for {RetractionNotice.objects.count()} "
             "retraction notices"
         )
-        RetractionNotice.objects.update(
-            comparisondate=Case(
-                When(
-                    artdate__isnull=False,
-                    then="artdate",
-                ),
-                When(
-                    journaldate__isnull=False,
-                    then="journaldate",
-                ),
-            )
-        )
-        logging.info("Done")
+        n = _update_comparison_date(RetractionNotice, ["artdate", "journaldate"])
+        logging.info(f"Done, {n} changed")
 
         logging.info(
             f"Updating comparison date for {CitingPaper.objects.count()} "
             "citing papers"
         )
-        CitingPaper.objects.update(
-            comparisondate=Case(
-                When(
-                    artdate__isnull=False,
-                    then="artdate",
-                ),
-                When(
-                    journaldate__isnull=False,
-                    then="journaldate",
-                ),
-                When(
-                    prismcoverdate__isnull=False,
-                    then="prismcoverdate",
-                ),
-            )
+        n = _update_comparison_date(
+            CitingPaper, ["artdate", "journaldate", "prismcoverdate"]
         )
-        logging.info("Done")
+        logging.info(f"Done, {n} changed")
@@ -0,0 +1,156 @@
+import datetime
+import logging
+from collections import Counter
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, F, Min, OuterRef, Q
+
+from retractions.models import (
+    Author,
+    CitationRetractionPair,
+    RetractedPaper,
+    RetractedPaperSummary,
+    RetractedPaperYearSummary,
+    RetractionNotice,
+)
+
+
+def dirty_papers():
+    """
+    Retracted papers with no summary, or whose retraction notices, citing
+    papers or contactable authors changed since it was computed
+    """
+    computed_at = OuterRef("summary__computed_at")
+    return RetractedPaper.objects.filter(
+        Q(summary__isnull=True)
+        | Q(updated_at__gt=F("summary__computed_at"))
+        | Exists(
+            CitationRetractionPair.objects.filter(
+                Q(contactable_authors_updated_at__gt=computed_at)
+                | Q(citingpaper__updated_at__gt=computed_at),
+                retractedpaper=OuterRef("pk"),
+            )
+        )
+        | Exists(
+            RetractionNotice.objects.filter(
+                papers=OuterRef("pk"), updated_at__gt=computed_at
+            )
+        )
+    )
+
+
+def update_summaries(pmids, computed_at):
+    papers = (
+        RetractedPaper.objects.filter(pmid__in=pmids)
+        .annotate(
+            earliest_notice_year=Min("notices__comparisondate__year"),
+            count_unique_in_rct=Count(
+                "citationretractionpair__contactable_authors",
+                filter=Q(citationretractionpair__citingpaper__cited_in_rct=True),
+                distinct=True,
+            ),
+            count_unique_after_rct=Count(
+                "citationretractionpair__contactable_authors",
+                filter=Q(citationretractionpair__citingpaper__cited_in_rct=False),
+                distinct=True,
+            ),
+        )
+        .values_list(
+            "pmid",
+            "comparisondate__year",
+            "earliest_notice_year",
+            "count_unique_in_rct",
+            "count_unique_after_rct",
+        )
+    )
+    summaries = [
+        RetractedPaperSummary(
+            retractedpaper_id=pmid,
+            comparison_year=comparison_year,
+            earliest_notice_year=earliest_notice_year,
+            count_unique_in_rct=count_unique_in_rct,
+            count_unique_after_rct=count_unique_after_rct,
+            computed_at=computed_at,
+        )
+        for (
+            pmid,
+            comparison_year,
+            earliest_notice_year,
+            count_unique_in_rct,
+            count_unique_after_rct,
+        ) in papers
+    ]
+
+    citation_counts = (
+        CitationRetractionPair.objects.filter(
+            retractedpaper__in=pmids, citingpaper__comparisondate__isnull=False
+        )
+        .values_list("retractedpaper", "citingpaper__comparisondate__year")
+        .annotate(citation_count=Count("pk"))
+        .order_by()
+    )
+    # The first year each contactable author cited each paper
+    first_years = (
+        Author.pairs.through.objects.filter(
+            citationretractionpair__retractedpaper__in=pmids,
+            citationretractionpair__citingpaper__comparisondate__isnull=False,
+        )
+        .values_list("citationretractionpair__retractedpaper", "author")
+        .annotate(
+            first_year=Min("citationretractionpair__citingpaper__comparisondate__year")
+        )
+        .order_by()
+    )
+    new_contactable_authors = Counter(
+        (pmid, first_year) for pmid, _, first_year in first_years
+    )
+    year_summaries = [
+        RetractedPaperYearSummary(
+            retractedpaper_id=pmid,
+            year=year,
+            citation_count=citation_count,
+            new_contactable_authors=new_contactable_authors[(pmid, year)],
+        )
+        for pmid, year, citation_count in citation_counts
+    ]
+
+    with transaction.atomic():
+        RetractedPaperSummary.objects.filter(retractedpaper__in=pmids).delete()
+        RetractedPaperYearSummary.objects.filter(retractedpaper__in=pmids).delete()
+        RetractedPaperSummary.objects.bulk_create(summaries)
+        RetractedPaperYearSummary.objects.bulk_create(year_summaries)
+
+
+class Command(BaseCommand):
+    help = """Update the per retracted paper citation and contactable author
+        counts used to randomise and generate datasets, for papers whose
+        citations changed since they were last summarised
+        """  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Summarise every retracted paper, not just those which changed",
+        )
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=1000,
+            help="Update database after batch size papers",
+        )
+
+    def handle(self, *args, **kwargs):
+        computed_at = datetime.datetime.now()
+        if kwargs["full"]:
+            papers = RetractedPaper.objects.all()
+        else:
+            papers = dirty_papers()
+        pmids = list(papers.order_by("pmid").values_list("pmid", flat=True))
+        logging.info(f"Summarising {len(pmids)} retracted papers")
+
+        batch = kwargs["batch"]
+        for i in range(0, len(pmids), batch):
+            update_summaries(pmids[i : i + batch], computed_at)
+        logging.info("Done")
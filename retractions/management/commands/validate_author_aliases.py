@@ -0,0 +1,57 @@
+import datetime
+import logging
+
+from django.core.management import BaseCommand
+
+from common import setup
+from retractions.models import AuthorAlias
+
+
+class Command(BaseCommand):
+    help = """Record whether each author alias has an email address which
+        anymail accepts, for aliases which have not been checked yet
+        """  # noqa: A003
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recheck every alias, not just those not checked yet",
+        )
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=10000,
+            help="Update database after batch size aliases",
+        )
+
+    def handle(self, *args, **kwargs):
+        setup.setup_logger(kwargs["verbosity"])
+        # Aliases without an email address have nothing to validate
+        aliases = AuthorAlias.objects.exclude(email_address__isnull=True).exclude(
+            email_address=""
+        )
+        if not kwargs["all"]:
+            aliases = aliases.filter(email_valid__isnull=True)
+        batch = kwargs["batch"]
+
+        logging.info(f"Validating email addresses of {aliases.count()} aliases")
+        changed = []
+        invalid = 0
+        for alias in aliases.only("email_address", "email_valid").iterator(
+            chunk_size=batch
+        ):
+            email_valid = alias.check_email_valid()
+            if email_valid is False:
+                invalid += 1
+            if email_valid != alias.email_valid:
+                alias.email_valid = email_valid
+                # bulk_update doesn't touch auto_now fields; a changed verdict
+                # can change who is contactable
+                alias.updated_at = datetime.datetime.now()
+                changed.append(alias)
+            if len(changed) >= batch:
+                AuthorAlias.objects.bulk_update(changed, ["email_valid", "updated_at"])
+                changed = []
+        AuthorAlias.objects.bulk_update(changed, ["email_valid", "updated_at"])
+        logging.info(f"Done, {invalid} invalid email addresses")
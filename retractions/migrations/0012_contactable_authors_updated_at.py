@@ -0,0 +1,31 @@
+# Generated by Django 4.2.10 on 2026-10-19 06:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0011_errors"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="author",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="authoralias",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="citationretractionpair",
+            name="contactable_authors_updated_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="When contactable authors were last computed for this pair",
+                null=True,
+            ),
+        ),
+    ]
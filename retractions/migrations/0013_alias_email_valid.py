@@ -0,0 +1,17 @@
+# Generated by Django 4.2.10 on 2026-10-19 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0012_contactable_authors_updated_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="authoralias",
+            name="email_valid",
+            field=models.BooleanField(blank=True, db_index=True, null=True),
+        ),
+    ]
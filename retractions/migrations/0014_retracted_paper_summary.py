@@ -0,0 +1,98 @@
+# Generated by Django 4.2.10 on 2026-10-19 06:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0013_alias_email_valid"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RetractedPaperSummary",
+            fields=[
+                (
+                    "retractedpaper",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="summary",
+                        serialize=False,
+                        to="retractions.retractedpaper",
+                    ),
+                ),
+                ("comparison_year", models.IntegerField(blank=True, null=True)),
+                (
+                    "earliest_notice_year",
+                    models.IntegerField(
+                        blank=True,
+                        help_text="Year of the earliest retraction notice comparison date",
+                        null=True,
+                    ),
+                ),
+                (
+                    "count_unique_in_rct",
+                    models.IntegerField(
+                        help_text="Distinct contactable authors of citing papers cited in the RCT"
+                    ),
+                ),
+                (
+                    "count_unique_after_rct",
+                    models.IntegerField(
+                        help_text="Distinct contactable authors of citing papers not cited in the RCT"
+                    ),
+                ),
+                (
+                    "computed_at",
+                    models.DateTimeField(
+                        help_text="When the inputs to this summary were read"
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "retracted_paper_summary",
+            },
+        ),
+        migrations.CreateModel(
+            name="RetractedPaperYearSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "year",
+                    models.IntegerField(help_text="Citing paper comparison date year"),
+                ),
+                (
+                    "citation_count",
+                    models.IntegerField(help_text="Citations in the year"),
+                ),
+                (
+                    "new_contactable_authors",
+                    models.IntegerField(
+                        help_text="Contactable authors first citing the paper in the year, so a running total gives distinct contactable authors up to a year"
+                    ),
+                ),
+                (
+                    "retractedpaper",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="year_summaries",
+                        to="retractions.retractedpaper",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "retracted_paper_year_summary",
+                "unique_together": {("retractedpaper", "year")},
+            },
+        ),
+    ]
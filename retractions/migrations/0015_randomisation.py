@@ -0,0 +1,49 @@
+# Generated by Django 4.2.10 on 2026-10-19 06:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0014_retracted_paper_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Randomisation",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "seed",
+                    models.CharField(
+                        help_text="Entropy of the numpy SeedSequence the randomisations were spawned from",
+                        max_length=100,
+                    ),
+                ),
+                (
+                    "simulated",
+                    models.BooleanField(
+                        help_text="Whether these were simulations rather than the RCT allocation"
+                    ),
+                ),
+                (
+                    "count",
+                    models.IntegerField(
+                        help_text="Number of randomisations per stratification"
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "db_table": "randomisation",
+            },
+        ),
+    ]
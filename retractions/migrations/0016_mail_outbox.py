@@ -0,0 +1,67 @@
+# Generated by Django 4.2.10 on 2026-10-19 07:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0015_randomisation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailOutbox",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued to be sent"),
+                            ("pending", "Claimed by a sender, and may have been sent"),
+                            ("sent", "Sent and recorded in MailSent"),
+                            ("failed", "Mailgun refused it, to be retried"),
+                        ],
+                        db_index=True,
+                        default="queued",
+                        max_length=10,
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("claimed_at", models.DateTimeField(blank=True, null=True)),
+                ("error", models.TextField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "author",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="outbox",
+                        to="retractions.author",
+                    ),
+                ),
+                (
+                    "mail_sent",
+                    models.OneToOneField(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="outbox",
+                        to="retractions.mailsent",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "mail_outbox",
+            },
+        ),
+    ]
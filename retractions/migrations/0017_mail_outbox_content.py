@@ -0,0 +1,73 @@
+# Generated by Django 4.2.10 on 2026-10-19 07:24
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+def remove_unsent(apps, schema_editor):
+    # Mails queued before mails were prepared in the outbox have no content,
+    # so are prepared again
+    MailOutbox = apps.get_model("retractions", "MailOutbox")
+    MailOutbox.objects.filter(status__in=["queued", "failed"]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0016_mail_outbox"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_unsent, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name="mailoutbox",
+            name="body_html",
+            field=models.TextField(default=""),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="mailoutbox",
+            name="body_text",
+            field=models.TextField(default=""),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="mailoutbox",
+            name="pairs",
+            field=models.ManyToManyField(
+                related_name="outbox", to="retractions.citationretractionpair"
+            ),
+        ),
+        migrations.AddField(
+            model_name="mailoutbox",
+            name="recentest_citing_paper_id",
+            field=models.TextField(
+                default="",
+                help_text="The Scopus ID of the most recent citing paper in the mail",
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="mailoutbox",
+            name="subject",
+            field=models.TextField(default=""),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="mailoutbox",
+            name="to",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.TextField(),
+                default=[],
+                help_text="Emails and names to send to, in form like an email To: field",
+                size=None,
+            ),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name="mailoutbox",
+            name="attempts",
+            field=models.IntegerField(
+                default=0, help_text="Attempts at sending since it was last queued"
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.10 on 2026-10-19 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0017_mail_outbox_content"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailgunEventCursor",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "timestamp",
+                    models.FloatField(
+                        help_text="Mailgun timestamp of the latest event processed"
+                    ),
+                ),
+                (
+                    "event_id",
+                    models.CharField(
+                        blank=True,
+                        help_text="Mailgun id of the latest event processed",
+                        max_length=100,
+                        null=True,
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "mailgun_event_cursor",
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.10 on 2026-10-19 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0018_mailgun_event_cursor"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MailgunEvent",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "event_id",
+                    models.CharField(
+                        help_text="Mailgun id of the event, or a hash of the event if it has none",
+                        max_length=100,
+                        unique=True,
+                    ),
+                ),
+                ("event", models.CharField(max_length=50)),
+                (
+                    "message_id",
+                    models.CharField(db_index=True, max_length=1000, null=True),
+                ),
+                ("timestamp", models.DateTimeField(db_index=True)),
+                ("url", models.TextField(blank=True, null=True)),
+                (
+                    "data",
+                    models.JSONField(
+                        help_text="The event as returned by the Mailgun API"
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "db_table": "mailgun_event",
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.10 on 2026-10-19 07:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0019_mailgun_event"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RetractedAuthorsCursor",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "pmid",
+                    models.CharField(
+                        help_text="PubMed ID of the last retracted paper whose page was saved",
+                        max_length=200,
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "retracted_authors_cursor",
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.10 on 2026-10-19 07:43
+
+from django.db import migrations
+
+
+def clear_sent(apps, schema_editor):
+    # Mails already sent are in MailSent and the archive, so the outbox
+    # needn't keep their addresses and names
+    MailOutbox = apps.get_model("retractions", "MailOutbox")
+    MailOutbox.objects.filter(status="sent").update(to=[], body_html="", body_text="")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("retractions", "0020_retracted_authors_cursor"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_sent, migrations.RunPython.noop),
+    ]
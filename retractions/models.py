@@ -1,5 +1,7 @@
 import urllib.parse
 
+import anymail.exceptions
+import anymail.utils
 from django.contrib.postgres.fields import ArrayField
 from django.db import models
 
@@ -122,14 +124,10 @@ class RetractedPaper(Paper):
         return url
 
     def get_notice(self):
-        # sort by PMID, which is roughly a sort by date
-        notices = (
-            self.notices.all()
-            .extra(select={"pmid_float": "pmid::float"})
-            .order_by("pmid_float")
-        )
-        # take the earliest retraction notice
-        return notices[0]
+        # take the earliest retraction notice, sorting by PMID, which is
+        # roughly a sort by date. Sorted in Python, as pmid::float would, so
+        # that notices loaded with prefetch_related don't need another query
+        return min(self.notices.all(), key=lambda notice: float(notice.pmid))
 
     class Meta:
         db_table = "retracted_paper"
@@ -221,11 +219,104 @@ class CitationRetractionPair(models.Model):
         max_length=2, choices=PublicationType.choices, null=True, blank=True
     )
 
+    contactable_authors_updated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When contactable authors were last computed for this pair",
+    )
+
     class Meta:
         db_table = "citing_paper_paper"
         unique_together = (("citingpaper", "retractedpaper"),)
 
 
+# Per retracted paper counts used in randomisation, simulations and dataset
+# generation, maintained by the update_paper_summaries command rather than
+# re-aggregated over the citations every time
+class RetractedPaperSummary(models.Model):
+    retractedpaper = models.OneToOneField(
+        RetractedPaper,
+        primary_key=True,
+        related_name="summary",
+        on_delete=models.CASCADE,
+    )
+    comparison_year = models.IntegerField(null=True, blank=True)
+    earliest_notice_year = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Year of the earliest retraction notice comparison date",
+    )
+    count_unique_in_rct = models.IntegerField(
+        help_text="Distinct contactable authors of citing papers cited in the RCT",
+    )
+    count_unique_after_rct = models.IntegerField(
+        help_text="Distinct contactable authors of citing papers not cited in the RCT",
+    )
+    computed_at = models.DateTimeField(
+        help_text="When the inputs to this summary were read",
+    )
+
+    class Meta:
+        db_table = "retracted_paper_summary"
+
+
+class RetractedPaperYearSummary(models.Model):
+    retractedpaper = models.ForeignKey(
+        RetractedPaper,
+        related_name="year_summaries",
+        on_delete=models.CASCADE,
+    )
+    year = models.IntegerField(help_text="Citing paper comparison date year")
+    citation_count = models.IntegerField(help_text="Citations in the year")
+    new_contactable_authors = models.IntegerField(
+        help_text=(
+            "Contactable authors first citing the paper in the year, so a "
+            "running total gives distinct contactable authors up to a year"
+        ),
+    )
+
+    class Meta:
+        db_table = "retracted_paper_year_summary"
+        unique_together = ("retractedpaper", "year")
+
+
+class Randomisation(models.Model):
+    """
+    Seed of each run of the RCT randomisation or of simulations, so that the
+    allocations can be reproduced
+    """
+
+    seed = models.CharField(
+        max_length=100,
+        help_text="Entropy of the numpy SeedSequence the randomisations were spawned from",
+    )
+    simulated = models.BooleanField(
+        help_text="Whether these were simulations rather than the RCT allocation",
+    )
+    count = models.IntegerField(help_text="Number of randomisations per stratification")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "randomisation"
+
+
+class RetractedAuthorsCursor(models.Model):
+    """
+    The last retracted paper contactable_authors got the authors of from
+    scopus in a run which hasn't finished, so that the next run carries on
+    after it
+    """
+
+    pmid = models.CharField(
+        max_length=200,
+        help_text="PubMed ID of the last retracted paper whose page was saved",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "retracted_authors_cursor"
+
+
 class Author(models.Model):
     citing_papers = models.ManyToManyField(CitingPaper, related_name="authors")
     retracted_papers = models.ManyToManyField(RetractedPaper, related_name="authors")
@@ -241,6 +332,8 @@ class Author(models.Model):
         unique=True,
     )
 
+    updated_at = models.DateTimeField(auto_now=True)
+
     class Meta:
         db_table = "author"
 
@@ -258,10 +351,30 @@ class AuthorAlias(models.Model):
     surname = models.CharField(max_length=1000, null=True, blank=True)
     given_name = models.CharField(max_length=1000, null=True, blank=True)
 
+    # Whether anymail accepts email_address, set on save and backfilled by
+    # the validate_author_aliases command. Null if there is no email address
+    # or it has not been checked yet
+    email_valid = models.BooleanField(null=True, blank=True, db_index=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
     class Meta:
         db_table = "author_alias"
         unique_together = ("author", "email_address")
 
+    def save(self, *args, **kwargs):
+        self.email_valid = self.check_email_valid()
+        super().save(*args, **kwargs)
+
+    def check_email_valid(self):
+        if not self.email_address:
+            return None
+        try:
+            anymail.utils.parse_single_address(self.email_address)
+        except anymail.exceptions.AnymailInvalidAddress:
+            return False
+        return True
+
     def full_name(self):
         return ("{} {}".format(self.given_name or "", self.surname or "")).strip()
 
@@ -313,3 +426,107 @@ class MailSent(models.Model):
 
     class Meta:
         db_table = "mail_sent"
+
+
+class MailOutbox(models.Model):
+    """
+    A mail prepared for an author, claimed by one sender at a time so that
+    each author is mailed at most once however many senders are running
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", "Queued to be sent"
+        PENDING = "pending", "Claimed by a sender, and may have been sent"
+        SENT = "sent", "Sent and recorded in MailSent"
+        FAILED = "failed", "Mailgun refused it, to be retried"
+
+    author = models.OneToOneField(
+        Author,
+        related_name="outbox",
+        on_delete=models.CASCADE,
+    )
+
+    # The rendered mail, and the pairs it is about
+    subject = models.TextField()
+    body_html = models.TextField()
+    body_text = models.TextField()
+    to = ArrayField(
+        models.TextField(),
+        help_text="Emails and names to send to, in form like an email To: field",
+    )
+    recentest_citing_paper_id = models.TextField(
+        help_text="The Scopus ID of the most recent citing paper in the mail",
+    )
+    pairs = models.ManyToManyField(
+        CitationRetractionPair,
+        related_name="outbox",
+    )
+
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.QUEUED,
+        db_index=True,
+    )
+    attempts = models.IntegerField(
+        default=0, help_text="Attempts at sending since it was last queued"
+    )
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    mail_sent = models.OneToOneField(
+        MailSent,
+        null=True,
+        blank=True,
+        related_name="outbox",
+        on_delete=models.SET_NULL,
+    )
+    error = models.TextField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "mail_outbox"
+
+
+class MailgunEventCursor(models.Model):
+    """
+    How far retrieve_mailgun_events has got through the Mailgun events, so
+    that each run only asks for events since the last
+    """
+
+    timestamp = models.FloatField(
+        help_text="Mailgun timestamp of the latest event processed",
+    )
+    event_id = models.CharField(
+        max_length=100,
+        null=True,
+        blank=True,
+        help_text="Mailgun id of the latest event processed",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "mailgun_event_cursor"
+
+
+class MailgunEvent(models.Model):
+    """
+    Every event fetched from Mailgun, as Mailgun gave it, so that the
+    summary times on MailSent can be derived again after Mailgun has
+    deleted the events
+    """
+
+    event_id = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text="Mailgun id of the event, or a hash of the event if it has none",
+    )
+    event = models.CharField(max_length=50)
+    message_id = models.CharField(max_length=1000, null=True, db_index=True)
+    timestamp = models.DateTimeField(db_index=True)
+    url = models.TextField(null=True, blank=True)
+    data = models.JSONField(help_text="The event as returned by the Mailgun API")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "mailgun_event"
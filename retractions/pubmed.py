@@ -1,34 +1,12 @@
 import datetime
 import json
 import logging
-import re
 
 import lxml.etree
 
 from common import fetch_utils
-
-
-month_mapper = {
-    "Jan": 1,
-    "Feb": 2,
-    "Mar": 3,
-    "Apr": 4,
-    "May": 5,
-    "Jun": 6,
-    "Jul": 7,
-    "Aug": 8,
-    "Sep": 9,
-    "Oct": 10,
-    "Nov": 11,
-    "Dec": 12,
-}
-
-season_mapper = {
-    "Summer": 7,
-    "Spring": 4,
-    "Winter": 1,
-    "Fall": 10,
-}
+from retractions import dates
+from retractions.dates import month_mapper
 
 
 def get_paper_xml(pmid):
@@ -286,55 +264,4 @@ def get_pubmed_date_from_node(node):
 
 
 def get_pubmed_date_from_medline(s):
-    subpatterns = {
-        "year": r"\d{4}",
-        "month": r"\w{3}",
-        "day": r"\d{1,2}",
-        "season": r"\w{4,6}",
-        "sep": " *[-/] *",
-    }
-
-    patterns = [
-        # eg "1983 Sep 22-28"
-        "({year}) ({month}) ({day}){sep}{day}",
-        # eg "2007 Aug 9-Sep 12",
-        "({year}) ({month}) ({day}){sep}{month} {day}",
-        # eg "1984 Jul-Aug",
-        "({year}) ({month}){sep}{month}",
-        # eg "Winter 2019",
-        "({season}) ({year})",
-        # eg "2012",
-        "({year})",
-    ]
-
-    for pattern in patterns:
-        pattern = pattern.format(**subpatterns) + "$"
-        match = re.match(pattern, s)
-        if match:
-            groups = match.groups()
-            # Season is special case where year does not come first
-            if groups[0] in season_mapper.keys():
-                month = season_mapper[groups[0]]
-                year = int(groups[1])
-                day = 1
-            else:
-                year = int(groups[0])
-
-                if len(groups) > 1:
-                    month = month_mapper[groups[1]]
-                else:
-                    month = 1
-
-                if len(groups) > 2:
-                    day = int(groups[2])
-                else:
-                    day = 1
-
-            granularity = {1: "y", 2: "m", 3: "d"}[len(groups)]
-
-            return {
-                "date": datetime.date(year, month, day),
-                "granularity": granularity,
-            }
-
-    return {"date": None, "granularity": None}
+    return dates.parse_medline_date(s)
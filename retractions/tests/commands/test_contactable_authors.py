@@ -1,8 +1,17 @@
+import unittest.mock
+
 from django.test import TestCase
 
 from common import setup
 from retractions.management.commands import contactable_authors
-from retractions.models import Author, AuthorAlias, RetractedPaper
+from retractions.models import (
+    Author,
+    AuthorAlias,
+    CitationRetractionPair,
+    CitingPaper,
+    RetractedAuthorsCursor,
+    RetractedPaper,
+)
 
 
 class CommandsTestCase(TestCase):
@@ -86,3 +95,177 @@ class CommandsTestCase(TestCase):
         self.assertEqual(a.author.auid, "23484157000")
         self.assertEqual(a.given_name, "Denise F.")
         self.assertEqual(a.email_address, "drsblakeinoz@bigpond.com")
+
+    def test_update_contactable_authors(self):
+        """Citing authors with a valid email are contactable, unless they are
+        also authors of the retracted paper"""
+        retracted_paper = RetractedPaper.objects.create(pmid="123", title="Foo bar")
+        citing_paper = CitingPaper.objects.create(
+            scopus_id="456", comparisondate="2020-01-01"
+        )
+        citing_paper.paper.add(retracted_paper)
+        authors = {}
+        for auid, email_address in [
+            ("1", "one@example.com"),
+            ("2", "two@example.com"),
+            ("3", "notavalidemail"),
+            ("4", None),
+        ]:
+            authors[auid] = Author.objects.create(auid=auid)
+            authors[auid].citing_papers.add(citing_paper)
+            AuthorAlias.objects.create(
+                author=authors[auid], email_address=email_address
+            )
+        authors["2"].retracted_papers.add(retracted_paper)
+
+        self.c._update_contactable_authors()
+        pair = CitationRetractionPair.objects.get()
+        self.assertEqual(
+            set(pair.contactable_authors.values_list("auid", flat=True)), {"1"}
+        )
+
+    def test_update_contactable_authors_incremental(self):
+        """Only pairs which changed since the last run are recomputed, unless
+        a full rebuild is asked for"""
+        retracted_paper = RetractedPaper.objects.create(pmid="123", title="Foo bar")
+        citing_paper = CitingPaper.objects.create(
+            scopus_id="456", comparisondate="2020-01-01"
+        )
+        citing_paper.paper.add(retracted_paper)
+        author = Author.objects.create(auid="1")
+        author.citing_papers.add(citing_paper)
+        alias = AuthorAlias.objects.create(author=author, email_address="notanemail")
+
+        self.c._update_contactable_authors()
+        pair = CitationRetractionPair.objects.get()
+        self.assertIsNotNone(pair.contactable_authors_updated_at)
+        self.assertEqual(pair.contactable_authors.count(), 0)
+
+        # Nothing changed, so the pair is left alone
+        author.pairs.add(pair)
+        self.c._update_contactable_authors()
+        self.assertEqual(pair.contactable_authors.count(), 1)
+
+        # Changing an alias marks the pair for recomputation
+        alias.email_address = "one@example.com"
+        alias.save()
+        pair.contactable_authors.clear()
+        self.c._update_contactable_authors()
+        self.assertEqual(pair.contactable_authors.count(), 1)
+
+        # A full rebuild recomputes everything
+        pair.contactable_authors.clear()
+        self.c._update_contactable_authors()
+        self.assertEqual(pair.contactable_authors.count(), 0)
+        self.c._update_contactable_authors(full=True)
+        self.assertEqual(pair.contactable_authors.count(), 1)
+
+    def test_update_contactable_authors_chunked(self):
+        """Pairs are computed the same whatever the chunk size"""
+        citing_paper = CitingPaper.objects.create(
+            scopus_id="456", comparisondate="2020-01-01"
+        )
+        for pmid in ["1", "2", "3"]:
+            citing_paper.paper.add(
+                RetractedPaper.objects.create(pmid=pmid, title="Foo bar")
+            )
+        author = Author.objects.create(auid="1")
+        author.citing_papers.add(citing_paper)
+        AuthorAlias.objects.create(author=author, email_address="one@example.com")
+
+        self.c._update_contactable_authors(chunk_size=2)
+        self.assertEqual(author.pairs.count(), 3)
+        self.assertFalse(
+            CitationRetractionPair.objects.filter(
+                contactable_authors_updated_at__isnull=True
+            ).exists()
+        )
+
+    def test_handle_default_chunk_size(self):
+        """handle works without the arguments argparse would have filled in"""
+        citing_paper = CitingPaper.objects.create(scopus_id="c1")
+        retracted_paper = RetractedPaper.objects.create(pmid="1")
+        CitationRetractionPair.objects.create(
+            citingpaper=citing_paper, retractedpaper=retracted_paper
+        )
+        self.c.handle(verbosity=1)
+        self.assertIsNotNone(
+            CitationRetractionPair.objects.get().contactable_authors_updated_at
+        )
+
+    def test_get_retracted_authors_pages(self):
+        """Every page of retracted papers is fetched, and a run can be
+        resumed after a pmid"""
+
+        class FakeResponse:
+            def __init__(self, url):
+                self.scopus_id = url.split("scopus_id/")[1].split("?")[0]
+
+            def json(self):
+                return {
+                    "abstracts-retrieval-response": {
+                        "coredata": {"eid": f"2-s2.0-{self.scopus_id}"},
+                        "item": {
+                            "bibrecord": {
+                                "head": {
+                                    "author-group": {
+                                        "author": {
+                                            "@auid": f"a{self.scopus_id}",
+                                            "ce:surname": "Blake",
+                                        }
+                                    }
+                                }
+                            }
+                        },
+                    }
+                }
+
+        def fake_fetch_urls_parallel(urls, is_scopus=False):
+            return [FakeResponse(url) for url in urls]
+
+        for pmid in ["1", "2", "3", "4", "5"]:
+            RetractedPaper.objects.create(pmid=pmid, scopus_id=f"s{pmid}")
+
+        with unittest.mock.patch(
+            "common.fetch_utils.fetch_urls_parallel",
+            side_effect=fake_fetch_urls_parallel,
+        ) as fetch:
+            self.c._get_retracted_authors(batch=2, after_pmid="1")
+            self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(
+            set(
+                RetractedPaper.objects.filter(authors__isnull=False).values_list(
+                    "pmid", flat=True
+                )
+            ),
+            {"2", "3", "4", "5"},
+        )
+
+    def test_get_retracted_authors_carries_on(self):
+        """A run which fails part way is carried on by the next run from the
+        last page it saved"""
+
+        def fake_fetch_urls_parallel(urls, is_scopus=False):
+            if "s3" in urls[0]:
+                raise ConnectionError()
+            return [None for url in urls]
+
+        for pmid in ["1", "2", "3", "4"]:
+            RetractedPaper.objects.create(pmid=pmid, scopus_id=f"s{pmid}")
+
+        with unittest.mock.patch(
+            "common.fetch_utils.fetch_urls_parallel",
+            side_effect=fake_fetch_urls_parallel,
+        ):
+            with self.assertRaises(ConnectionError):
+                self.c._get_retracted_authors(batch=2)
+        self.assertEqual(RetractedAuthorsCursor.objects.get().pmid, "2")
+
+        with unittest.mock.patch(
+            "common.fetch_utils.fetch_urls_parallel", return_value=[None, None]
+        ) as fetch:
+            self.c._get_retracted_authors(batch=2)
+        fetch.assert_called_once()
+        self.assertIn("s3", fetch.call_args.args[0][0])
+        # Finished, so the next run starts from the beginning
+        self.assertFalse(RetractedAuthorsCursor.objects.exists())
@@ -176,6 +176,23 @@ class CommandsTestCase(TestCase):
         self.assertEqual(citing_paper.issn, "17388872 10177825")
         self.assertEqual(citing_paper.pmid, "29913552")
 
+    @vcr.use_cassette(
+        "fixtures/vcr_cassettes/citation_two.yaml",
+        allow_playback_repeats=True,
+        filter_headers=["X-ELS-APIKey", "X-ELS-Insttoken"],
+        before_record_response=scrub_string,
+    )
+    def test_update_citation_two_parse_workers(self):
+        scopus_id = "85050606598"
+        retracted_paper = RetractedPaper.objects.create(pmid="123", title="Foo bar")
+        citing_paper = CitingPaper.objects.create(scopus_id=scopus_id)
+        citing_paper.paper.add(retracted_paper)
+        self.c.handle(verbosity=0, scopus_only=True, pubmed_only=False, parse_workers=2)
+        citing_paper.refresh_from_db()
+        self.assertEqual(citing_paper.issn, "17388872 10177825")
+        self.assertEqual(citing_paper.pmid, "29913552")
+        self.assertEqual(citing_paper.prismcoverdate, datetime.date(2018, 7, 1))
+
     def test_update_citing_paper_normal(self):
         retracted_paper = RetractedPaper.objects.create(pmid="123", title="Foo bar")
         scopus_id = "84896692651"
@@ -7,15 +7,19 @@ from django.core import mail
 from django.core.exceptions import EmptyResultSet
 from django.core.files.temp import NamedTemporaryFile
 from django.core.management import call_command
-from django.test import TransactionTestCase
+from django.test import TestCase, TransactionTestCase
 from django.test.utils import override_settings
 
+from retractions.management.commands import randomise
 from retractions.models import (
     Author,
     AuthorAlias,
+    CitationRetractionPair,
     CitingPaper,
     MailSent,
+    Randomisation,
     RetractedPaper,
+    RetractedPaperSummary,
     RetractionNotice,
 )
 
@@ -298,6 +302,21 @@ class RCTRandomisationTestCase(TransactionTestCase):
         with self.assertRaises(AssertionError):
             call_command("randomise", "set_randomisation")
 
+    def test_rct_randomisation_seed(self):
+        """Randomising with a seed is reproducible, and the seed is recorded"""
+        call_command("randomise", "update_exclusions")
+        call_command("randomise", "set_randomisation", "--seed", "1234")
+        first = dict(RetractedPaper.objects.values_list("pmid", "rct_group"))
+
+        RetractedPaper.objects.update(rct_group=None)
+        call_command("randomise", "set_randomisation", "--seed", "1234")
+        second = dict(RetractedPaper.objects.values_list("pmid", "rct_group"))
+        self.assertEqual(first, second)
+        self.assertEqual(
+            list(Randomisation.objects.values_list("seed", "simulated")),
+            [("1234", False), ("1234", False)],
+        )
+
 
 @override_settings(EMAIL_BACKEND="anymail.backends.test.EmailBackend")
 class GenDatasetTestCase(TransactionTestCase):
@@ -337,6 +356,59 @@ class GenDatasetTestCase(TransactionTestCase):
         self.assertTrue(df.contaminated[1])
         self.assertFalse(df.contaminated[2])
 
+    def test_gen_dataset_formats(self):
+        """
+        Columnar datasets hold the same data as csv, with treatment codes
+        """
+        csv = NamedTemporaryFile(delete=True)
+        call_command("randomise", "gen_dataset", "--output-file", csv.name)
+        expected = pandas.read_csv(csv.name)
+        self.assertEqual(set(expected.rct_group), {"i", "c"})
+        expected["rct_group"] = (expected.rct_group == "i").astype("int8")
+        for file_format, read in [
+            ("parquet", pandas.read_parquet),
+            ("arrow", pandas.read_feather),
+        ]:
+            res = NamedTemporaryFile(delete=True)
+            call_command(
+                "randomise",
+                "gen_dataset",
+                "--output-file",
+                res.name,
+                "--format",
+                file_format,
+            )
+            df = read(res.name)
+            self.assertEqual(df.rct_group.dtype, "int8")
+            self.assertEqual(df.index.name, "pmid")
+            df = df.reset_index()
+            df["pmid"] = df.pmid.astype(int)
+            pandas.testing.assert_frame_equal(
+                df, expected, check_dtype=False, check_categorical=False
+            )
+
+    def test_contaminated_authors(self):
+        """
+        Contaminated authors are those contactable about papers in both groups
+        """
+        pairs = CitationRetractionPair.objects.filter(citingpaper__cited_in_rct=True)
+        intervention = set(
+            pairs.filter(retractedpaper__rct_group="i").values_list(
+                "contactable_authors", flat=True
+            )
+        )
+        control = set(
+            pairs.filter(retractedpaper__rct_group="c").values_list(
+                "contactable_authors", flat=True
+            )
+        )
+        expected = (intervention & control) - {None}
+        self.assertTrue(expected)
+        self.assertEqual(
+            set(randomise.contaminated_authors().values_list("pk", flat=True)),
+            expected,
+        )
+
 
 @override_settings(EMAIL_BACKEND="anymail.backends.test.EmailBackend")
 class WashoutTestCase(TransactionTestCase):
@@ -406,3 +478,30 @@ class RemoveCiting(TransactionTestCase):
         self.assertTrue(df.loc[2000007].count_unique, 2)
         self.assertTrue(df.loc[2000008].count_unique, 3)
         self.assertTrue(df.loc[2000009].count_unique, 1)
+
+
+class StrataTestCase(TestCase):
+    def test_annotate_strata_update(self):
+        """Strata are set for every paper in one query"""
+        for pmid, count_unique in [("1", 0), ("2", 15), ("3", 120), ("4", 7000)]:
+            paper = RetractedPaper.objects.create(pmid=pmid)
+            RetractedPaperSummary.objects.create(
+                retractedpaper=paper,
+                count_unique_in_rct=count_unique,
+                count_unique_after_rct=0,
+                computed_at="2024-01-01",
+            )
+        # Without a summary, a paper has no contactable authors
+        RetractedPaper.objects.create(pmid="5")
+
+        papers = randomise._annotate_count_unique(RetractedPaper.objects.all())
+        with self.assertNumQueries(1):
+            papers = randomise._annotate_strata(
+                papers, "groups", randomise.manual_cuts, update=True
+            )
+        expected = {"1": 0, "2": 1, "3": 4, "4": 8, "5": 0}
+        self.assertEqual(
+            dict(RetractedPaper.objects.values_list("pmid", "stratifying_group")),
+            expected,
+        )
+        self.assertEqual(dict(papers.values_list("pmid", "groups")), expected)
@@ -1,4 +1,5 @@
 import datetime
+import time
 import unittest.mock
 
 from django.core import mail
@@ -6,7 +7,7 @@ from django.core.management import call_command
 from django.test import TransactionTestCase
 from django.test.utils import override_settings
 
-from retractions.models import MailSent
+from retractions.models import MailgunEvent, MailgunEventCursor, MailSent
 
 
 class FakeResponse:
@@ -33,13 +34,16 @@ def fake_get(message_id, test_case):
 
     "default" - one message which is opened, and 'already knew' clicked
     "multipage" - two pages of results with a click on each page
+
+    The query parameters of each request are recorded in its params_sent.
     """
 
     assert test_case in ["default", "multipage"]
 
-    def _inner_fake_get(url, auth):
+    def _inner_fake_get(url, auth, params=None):
         """Overrides requests.get to pretends to be the MailGun API in a limited
         way"""
+        _inner_fake_get.params_sent.append(params)
         base_url = "https://api.eu.mailgun.net/v3/retracted.net/events"
         second_url = base_url + "/2"
         third_url = base_url + "/3"
@@ -140,6 +144,7 @@ def fake_get(message_id, test_case):
             }
         )
 
+    _inner_fake_get.params_sent = []
     return _inner_fake_get
 
 
@@ -199,3 +204,84 @@ class CommandsTestCase(TransactionTestCase):
             mail_sent.clicked_alreadyknewall,
             datetime.datetime(2018, 6, 30, 8, 1, 34, 191660),
         )
+
+    def test_events_applied_per_page(self):
+        """A page of events is stored and applied to the mails they are about
+        at once, rather than per event"""
+
+        with unittest.mock.patch("requests.get", fake_get(self.message_id, "default")):
+            # Load the cursor, store the events in a transaction, check which
+            # mails they are about, roll them up, then save the cursor
+            with self.assertNumQueries(7):
+                call_command("retrieve_mailgun_events")
+
+        mail_sent = MailSent.objects.get()
+        self.assertEqual(
+            mail_sent.accepted, datetime.datetime(2018, 6, 26, 8, 0, 0, 191660)
+        )
+        self.assertEqual(
+            mail_sent.delivered, datetime.datetime(2018, 6, 29, 12, 59, 4, 191660)
+        )
+
+    def test_polls_from_last_event(self):
+        """The first run asks for the events Mailgun keeps, oldest first, and
+        later runs only for those since the latest event processed"""
+
+        get = fake_get(self.message_id, "default")
+        with unittest.mock.patch("requests.get", get):
+            call_command("retrieve_mailgun_events")
+        params = get.params_sent[0]
+        self.assertEqual(params["ascending"], "yes")
+        self.assertAlmostEqual(params["begin"], time.time() - 30 * 86400, delta=60)
+        # The next page URL carries on the query
+        self.assertEqual(get.params_sent[1:], [None])
+        self.assertEqual(MailgunEventCursor.objects.get().timestamp, 1530345694.19166)
+
+        get = fake_get(self.message_id, "default")
+        with unittest.mock.patch("requests.get", get):
+            call_command("retrieve_mailgun_events", "--overlap=10")
+        self.assertEqual(get.params_sent[0]["begin"], 1530345694.19166 - 600)
+        # Events seen again in the overlap change nothing
+        mail_sent = MailSent.objects.get()
+        self.assertEqual(
+            mail_sent.opened, datetime.datetime(2018, 6, 30, 8, 1, 4, 191660)
+        )
+        self.assertEqual(MailgunEventCursor.objects.count(), 1)
+
+    def test_events_stored_once(self):
+        """Every event is stored as Mailgun gave it, once however many times
+        it is fetched"""
+
+        for _ in range(2):
+            with unittest.mock.patch(
+                "requests.get", fake_get(self.message_id, "multipage")
+            ):
+                call_command("retrieve_mailgun_events", "--full")
+
+        self.assertEqual(MailgunEvent.objects.count(), 6)
+        click = MailgunEvent.objects.filter(event="clicked").earliest("timestamp")
+        self.assertEqual(click.message_id, str(self.message_id))
+        self.assertEqual(click.url, "//retracted.net/response/alreadyknewall")
+        self.assertEqual(click.data["recipient"], "tofu@beans.com")
+
+    def test_rollup_only(self):
+        """The times on mails sent can be derived again from the stored
+        events without asking Mailgun"""
+
+        with unittest.mock.patch("requests.get", fake_get(self.message_id, "default")):
+            call_command("retrieve_mailgun_events")
+        MailSent.objects.update(opened=None, clicked_alreadyknewall=None)
+
+        with unittest.mock.patch("requests.get") as get:
+            call_command("retrieve_mailgun_events", "--rollup-only")
+        get.assert_not_called()
+
+        mail_sent = MailSent.objects.get()
+        self.assertEqual(
+            mail_sent.opened, datetime.datetime(2018, 6, 30, 8, 1, 4, 191660)
+        )
+        self.assertEqual(
+            mail_sent.clicked_alreadyknewall,
+            datetime.datetime(2018, 6, 30, 8, 1, 34, 191660),
+        )
+        self.assertIsNone(mail_sent.clicked_other)
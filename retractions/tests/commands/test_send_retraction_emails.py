@@ -1,3 +1,6 @@
+import pathlib
+import tempfile
+import threading
 import unittest.mock
 
 import anymail.backends.test
@@ -8,11 +11,14 @@ from django.core.management import call_command
 from django.test import TransactionTestCase
 from django.test.utils import override_settings
 
+from retractions import mail_archive
+from retractions.management.commands import send_retraction_emails
 from retractions.models import (
     Author,
     AuthorAlias,
     CitationRetractionPair,
     CitingPaper,
+    MailOutbox,
     MailSent,
     RetractedPaper,
 )
@@ -44,6 +50,10 @@ class CitedAfterTestCase(TransactionTestCase):
             '"The RetractoBot Team, University of Oxford" <team@retracted.net>',
         )
         self.assertEqual(email.recentest_citing_paper_id, "500000")
+        archived = mail_archive.MailArchive("live-all-sent-mails").get(
+            MailSent.objects.get().message_id
+        )
+        self.assertEqual(archived["To"], '"Victor S. Tofu" <tofu@beans.com>')
         html = email.alternatives[0][0]
         # Check copy is as in Protocol Appendix 2
         self.assertIn(
@@ -57,6 +67,18 @@ class CitedAfterTestCase(TransactionTestCase):
             "was retracted in 2001</a>",
             html,
         )
+        # The plain text part is rendered from its own template
+        self.assertIn(
+            '"Empagliflozin limits Tofu eating" (Frontiers in Tofu, 2017)',
+            email.body,
+        )
+        self.assertIn(
+            "which was retracted in 2001 "
+            "(https://www.ncbi.nlm.nih.gov/pubmed/?term=4000)",
+            email.body,
+        )
+        self.assertIn("https://retracted.net/response/didntknowany", email.body)
+        self.assertNotIn("<", email.body)
 
 
 @override_settings(EMAIL_BACKEND="anymail.backends.test.EmailBackend")
@@ -78,6 +100,28 @@ class CitedTwoAliases(TransactionTestCase):
             ],
         )
 
+    def test_undeliverable_file(self):
+        """Addresses the validation results say not to mail are skipped,
+        whatever their case, across chunks of the file"""
+        with tempfile.TemporaryDirectory() as tmp:
+            results_path = pathlib.Path(tmp) / "results.csv"
+            results_path.write_text(
+                "address,result,reason\n"
+                "tofu@beans.com,deliverable,accepted_email\n"
+                "other@beans.com,undeliverable,mailbox_does_not_exist\n"
+                "Tofu@Prior.edu,do_not_send,\n"
+            )
+            with unittest.mock.patch.object(
+                send_retraction_emails, "UNDELIVERABLE_CHUNK_SIZE", 2
+            ):
+                call_command(
+                    "send_retraction_emails",
+                    "--live-run",
+                    f"--undeliverable-file={results_path}",
+                )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['"Victor S. Tofu" <tofu@beans.com>'])
+
 
 @override_settings(EMAIL_BACKEND="anymail.backends.test.EmailBackend")
 class TwoRetractedPapersTestCase(TransactionTestCase):
@@ -113,6 +157,146 @@ class TwoRetractedPapersTestCase(TransactionTestCase):
             html,
         )
 
+    def test_dry_run_queries(self):
+        """Mails are composed from data loaded a chunk of authors at a time,
+        rather than querying per author, pair and paper"""
+        a = Author.objects.create(pk=1001, auid="1001")
+        a.citing_papers.set(CitingPaper.objects.all())
+        a.pairs.set(CitationRetractionPair.objects.all())
+        AuthorAlias.objects.create(
+            author=a,
+            email_address="beans@tofu.com",
+            surname="Soya",
+            given_name="Victoria",
+        )
+
+        # Count and select authors, then prefetch their pairs, notices,
+        # aliases and sent mails
+        with self.assertNumQueries(6):
+            call_command("send_retraction_emails")
+        archive = mail_archive.MailArchive("debug-last-sent-mails")
+        self.assertCountEqual(
+            [entry["auid"] for entry in archive.entries()], ["1000", "1001"]
+        )
+
+    def test_live_run_concurrent(self):
+        """Mails sent concurrently are each recorded once"""
+        a = Author.objects.create(pk=1001, auid="1001")
+        a.citing_papers.set(CitingPaper.objects.all())
+        a.pairs.set(CitationRetractionPair.objects.all())
+        AuthorAlias.objects.create(
+            author=a,
+            email_address="beans@tofu.com",
+            surname="Soya",
+            given_name="Victoria",
+        )
+
+        call_command("send_retraction_emails", "--live-run", "--concurrency=2")
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(
+            sorted(email.to for email in mail.outbox),
+            [['"Victor S. Tofu" <tofu@beans.com>'], ["Victoria Soya <beans@tofu.com>"]],
+        )
+        for mail_sent in MailSent.objects.all():
+            self.assertEqual(
+                set(mail_sent.pairs.all()), set(mail_sent.author.pairs.all())
+            )
+            self.assertEqual(mail_sent.recentest_citing_paper_id, "500010")
+            self.assertIsNotNone(mail_sent.message_id)
+        self.assertEqual(
+            sorted(MailSent.objects.values_list("author", flat=True)), [1000, 1001]
+        )
+
+        # Nothing more to send
+        call_command("send_retraction_emails", "--live-run", "--concurrency=2")
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_sender_stops_part_way(self):
+        """Mails are recorded as they are sent, so a sender which stops part
+        way through a chunk leaves only the mail it was sending unknown, and
+        queues the rest again"""
+        a = Author.objects.create(pk=1001, auid="1001")
+        a.citing_papers.set(CitingPaper.objects.all())
+        a.pairs.set(CitationRetractionPair.objects.all())
+        AuthorAlias.objects.create(
+            author=a,
+            email_address="beans@tofu.com",
+            surname="Soya",
+            given_name="Victoria",
+        )
+
+        with unittest.mock.patch.object(
+            MailSent.objects, "create", side_effect=django.db.Error()
+        ):
+            self.assertRaises(
+                django.db.utils.Error,
+                call_command,
+                "send_retraction_emails",
+                "--live-run",
+            )
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            MailOutbox.objects.get(author=1000).status, MailOutbox.Status.PENDING
+        )
+        outbox = MailOutbox.objects.get(author=1001)
+        self.assertEqual(outbox.status, MailOutbox.Status.QUEUED)
+        self.assertEqual(outbox.attempts, 0)
+
+        call_command("send_retraction_emails", "--live-run")
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[1].to, ["Victoria Soya <beans@tofu.com>"])
+
+
+@override_settings(EMAIL_BACKEND="anymail.backends.test.EmailBackend")
+class PrepareDeliverTestCase(TransactionTestCase):
+    fixtures = ["email_two_retracted_papers.json"]
+    reset_sequences = True
+
+    def test_prepare_then_deliver(self):
+        """Mails are rendered into the outbox, then sent as rendered"""
+        call_command("send_retraction_emails", "--live-run", "--phase=prepare")
+        self.assertEqual(len(mail.outbox), 0)
+        outbox = MailOutbox.objects.get(author=1000)
+        self.assertEqual(outbox.status, MailOutbox.Status.QUEUED)
+        self.assertEqual(outbox.to, ['"Victor S. Tofu" <tofu@beans.com>'])
+        self.assertEqual(outbox.recentest_citing_paper_id, "500010")
+        self.assertIn("response/alreadyknewsome", outbox.body_html)
+        self.assertEqual(
+            set(outbox.pairs.all()), set(CitationRetractionPair.objects.all())
+        )
+
+        # Preparing again doesn't prepare another mail
+        call_command("send_retraction_emails", "--live-run", "--phase=prepare")
+        self.assertEqual(MailOutbox.objects.count(), 1)
+
+        # The mail is sent as it was prepared
+        outbox.subject = "Prepared subject"
+        outbox.save()
+        call_command(
+            "send_retraction_emails", "--live-run", "--phase=deliver", "--rate=100"
+        )
+        self.assertEqual(len(mail.outbox), 1)
+        email = mail.outbox[0]
+        self.assertEqual(email.subject, "Prepared subject")
+        self.assertEqual(email.to, ['"Victor S. Tofu" <tofu@beans.com>'])
+        self.assertEqual(email.alternatives[0][0], outbox.body_html)
+        self.assertEqual(email.recentest_citing_paper_id, "500010")
+        mail_sent = MailSent.objects.get(author=1000)
+        self.assertEqual(
+            set(mail_sent.pairs.all()), set(CitationRetractionPair.objects.all())
+        )
+        outbox.refresh_from_db()
+        self.assertEqual(outbox.status, MailOutbox.Status.SENT)
+        self.assertEqual(outbox.mail_sent, mail_sent)
+        # Addresses and names aren't kept in the outbox once sent
+        self.assertEqual(outbox.to, [])
+        self.assertEqual(outbox.body_html, "")
+        self.assertEqual(outbox.body_text, "")
+
+        # Nothing more to send
+        call_command("send_retraction_emails", "--live-run")
+        self.assertEqual(len(mail.outbox), 1)
+
 
 @override_settings(EMAIL_BACKEND="anymail.backends.test.EmailBackend")
 class NoCitationTestCase(TransactionTestCase):
@@ -168,6 +352,10 @@ class MailSendErrors(TransactionTestCase):
             call_command("send_retraction_emails", "--live-run")
 
         self.assertEqual(len(mail.outbox), 0)
+        outbox = MailOutbox.objects.get(author=1000)
+        self.assertEqual(outbox.status, MailOutbox.Status.FAILED)
+        # Tried up to --max-attempts times
+        self.assertEqual(outbox.attempts, 3)
 
         # Try again while it is working
         call_command("send_retraction_emails", "--live-run")
@@ -175,11 +363,12 @@ class MailSendErrors(TransactionTestCase):
 
     def test_database_error(self):
         """Sending a mail when the database throws an exception
-        succeeds, ending the script, and will try again next time"""
+        succeeds, ending the script. The author may have been mailed, so
+        isn't mailed again unless asked to"""
 
         # Try while the database is failing
         with unittest.mock.patch.object(
-            MailSent, "save", side_effect=django.db.Error()
+            MailSent.objects, "create", side_effect=django.db.Error()
         ):
             self.assertRaises(
                 django.db.utils.Error,
@@ -190,17 +379,144 @@ class MailSendErrors(TransactionTestCase):
         # Note that in this case the mail has been sent, we
         # just didn't record in the database that it was :(
         self.assertEqual(len(mail.outbox), 1)
+        outbox = MailOutbox.objects.get(author=1000)
+        self.assertEqual(outbox.status, MailOutbox.Status.PENDING)
+        self.assertEqual(outbox.attempts, 1)
 
         # Try again while the database is working again
         call_command("send_retraction_emails", "--live-run")
-        # The mail gets sent (again)
+        # The author was claimed by a sender which didn't finish, so isn't
+        # mailed again
+        self.assertEqual(len(mail.outbox), 1)
+
+        # The sender may still be running, so it isn't sent again straight
+        # away even when asked to
+        call_command("send_retraction_emails", "--live-run", "--requeue-pending")
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            MailOutbox.objects.get(author=1000).status, MailOutbox.Status.PENDING
+        )
+
+        # Once the Mailgun logs show it wasn't sent, send it again
+        call_command(
+            "send_retraction_emails",
+            "--live-run",
+            "--requeue-pending",
+            "--stale-after=0",
+        )
         self.assertEqual(len(mail.outbox), 2)
+        outbox.refresh_from_db()
+        self.assertEqual(outbox.status, MailOutbox.Status.SENT)
+        self.assertEqual(outbox.mail_sent, MailSent.objects.get(author=1000))
+        self.assertEqual(outbox.attempts, 1)
 
         # Third time lucky
-        call_command("send_retraction_emails", "--live-run")
+        call_command(
+            "send_retraction_emails",
+            "--live-run",
+            "--requeue-pending",
+            "--stale-after=0",
+        )
         # No more mails
         self.assertEqual(len(mail.outbox), 2)
 
+    def test_prepared_by_another_process(self):
+        """A mail queued by another process preparing at the same time is
+        kept, rather than failing the chunk"""
+        compose = send_retraction_emails.Command._composed_chunks
+
+        def composed_chunks(command, authors, limit=None):
+            for mails in compose(command, authors, limit):
+                # The other process queues the same mails first
+                for author, mail_to_send in mails:
+                    MailOutbox.objects.create(
+                        author=author,
+                        subject="Queued by the other process",
+                        body_html=mail_to_send.alternatives[0][0],
+                        body_text=mail_to_send.body,
+                        to=mail_to_send.to,
+                        recentest_citing_paper_id="500000",
+                    ).pairs.set(mail_to_send.pairs)
+                yield mails
+
+        with unittest.mock.patch.object(
+            send_retraction_emails.Command, "_composed_chunks", composed_chunks
+        ):
+            call_command("send_retraction_emails", "--live-run", "--phase=prepare")
+
+        outbox = MailOutbox.objects.get(author=1000)
+        self.assertEqual(outbox.subject, "Queued by the other process")
+        self.assertEqual(outbox.pairs.count(), 1)
+
+    def test_already_mailed_check_fails(self):
+        """If the check that authors haven't already been mailed fails,
+        nothing is sent and the chunk is queued again"""
+        claim = send_retraction_emails.Command._claim
+
+        def claim_then_mailed_elsewhere(command):
+            claimed = claim(command)
+            if claimed:
+                MailSent.objects.create(author_id=1000, message_id="other")
+            return claimed
+
+        with unittest.mock.patch.object(
+            send_retraction_emails.Command, "_claim", claim_then_mailed_elsewhere
+        ):
+            with self.assertRaises(AssertionError):
+                call_command("send_retraction_emails", "--live-run")
+        self.assertEqual(len(mail.outbox), 0)
+        outbox = MailOutbox.objects.get(author=1000)
+        self.assertEqual(outbox.status, MailOutbox.Status.QUEUED)
+        self.assertEqual(outbox.attempts, 0)
+
+        # The next run finds it was mailed, rather than failing again
+        call_command("send_retraction_emails", "--live-run")
+        self.assertEqual(len(mail.outbox), 0)
+        outbox.refresh_from_db()
+        self.assertEqual(outbox.status, MailOutbox.Status.SENT)
+
+    def test_outbox_reconciled(self):
+        """A mail recorded as sent by a sender which didn't finish is marked
+        sent in the outbox, and not sent again"""
+        call_command("send_retraction_emails", "--live-run")
+        self.assertEqual(len(mail.outbox), 1)
+        MailOutbox.objects.update(status=MailOutbox.Status.PENDING, mail_sent=None)
+
+        call_command("send_retraction_emails", "--live-run", "--requeue-pending")
+        self.assertEqual(len(mail.outbox), 1)
+        outbox = MailOutbox.objects.get(author=1000)
+        self.assertEqual(outbox.status, MailOutbox.Status.SENT)
+        self.assertEqual(outbox.mail_sent, MailSent.objects.get(author=1000))
+
+    def test_claimed_by_another_sender(self):
+        """An author claimed by another sender at the same time is skipped"""
+        call_command("send_retraction_emails", "--live-run", "--phase=prepare")
+        locked = threading.Event()
+        release = threading.Event()
+
+        def other_sender():
+            try:
+                with django.db.transaction.atomic():
+                    list(MailOutbox.objects.select_for_update())
+                    locked.set()
+                    release.wait(timeout=30)
+            finally:
+                django.db.connection.close()
+
+        thread = threading.Thread(target=other_sender)
+        thread.start()
+        locked.wait(timeout=30)
+        call_command("send_retraction_emails", "--live-run")
+        release.set()
+        thread.join()
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            MailOutbox.objects.get(author=1000).status, MailOutbox.Status.QUEUED
+        )
+
+        call_command("send_retraction_emails", "--live-run")
+        self.assertEqual(len(mail.outbox), 1)
+
 
 @override_settings(EMAIL_BACKEND="anymail.backends.test.EmailBackend")
 class NewEmailsAndAuthorsAppear(TransactionTestCase):
@@ -0,0 +1,49 @@
+import email.message
+import io
+import mailbox
+import pathlib
+import tempfile
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
+
+from retractions import mail_archive
+
+
+class ShowSentMailTestCase(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = pathlib.Path(tmp.name)
+        archive = mail_archive.MailArchive(self.tmp / "archive")
+        for message_id, auid, subject in [
+            ("1.mg", "1000", "First"),
+            ("2.mg", "1001", "Second"),
+            ("3.mg", "1000", "Third"),
+        ]:
+            msg = email.message.EmailMessage()
+            msg["To"] = "tofu@beans.com"
+            msg["Subject"] = subject
+            msg.set_content("Body")
+            archive.add(msg, message_id=message_id, auid=auid)
+
+    def test_by_message_id(self):
+        out = io.StringIO()
+        call_command(
+            "show_sent_mail",
+            f"--archive={self.tmp / 'archive'}",
+            "--message-id=2.mg",
+            stdout=out,
+        )
+        self.assertIn("Subject: Second", out.getvalue())
+        self.assertNotIn("Subject: First", out.getvalue())
+
+    def test_by_auid_to_mbox(self):
+        call_command(
+            "show_sent_mail",
+            f"--archive={self.tmp / 'archive'}",
+            "--auid=1000",
+            f"--mbox={self.tmp / 'sent.mbox'}",
+        )
+        mb = mailbox.mbox(self.tmp / "sent.mbox")
+        self.assertEqual([msg["Subject"] for msg in mb], ["First", "Third"])
@@ -0,0 +1,85 @@
+from django.core.management import call_command
+from django.test import TestCase
+
+from common import setup
+from retractions.management.commands import randomise
+from retractions.models import (
+    Author,
+    CitationRetractionPair,
+    CitingPaper,
+    RetractedPaper,
+    RetractedPaperSummary,
+    RetractionNotice,
+)
+
+
+class CommandsTestCase(TestCase):
+    def setUp(self):
+        setup.setup_logger(2)
+        self.retracted_paper = RetractedPaper.objects.create(
+            pmid="123", comparisondate="2010-01-01"
+        )
+        notice = RetractionNotice.objects.create(
+            pmid="456", comparisondate="2011-06-01"
+        )
+        notice.papers.add(self.retracted_paper)
+        self.citing_papers = {}
+        for scopus_id, comparisondate, cited_in_rct in [
+            ("1", "2015-01-01", True),
+            ("2", "2016-01-01", True),
+            ("3", "2023-01-01", False),
+        ]:
+            citing_paper = CitingPaper.objects.create(
+                scopus_id=scopus_id,
+                comparisondate=comparisondate,
+                cited_in_rct=cited_in_rct,
+            )
+            citing_paper.paper.add(self.retracted_paper)
+            self.citing_papers[scopus_id] = citing_paper
+        for auid, scopus_ids in [("a", ["1", "2"]), ("b", ["2"]), ("c", ["3"])]:
+            author = Author.objects.create(auid=auid)
+            author.pairs.add(
+                *CitationRetractionPair.objects.filter(citingpaper__in=scopus_ids)
+            )
+
+    def test_update_paper_summaries(self):
+        call_command("update_paper_summaries")
+
+        summary = self.retracted_paper.summary
+        self.assertEqual(summary.comparison_year, 2010)
+        self.assertEqual(summary.earliest_notice_year, 2011)
+        self.assertEqual(summary.count_unique_in_rct, 2)
+        self.assertEqual(summary.count_unique_after_rct, 1)
+        self.assertEqual(
+            list(
+                self.retracted_paper.year_summaries.order_by("year").values_list(
+                    "year", "citation_count", "new_contactable_authors"
+                )
+            ),
+            [(2015, 1, 1), (2016, 1, 1), (2023, 1, 1)],
+        )
+
+        # Distinct contactable authors up to a year are a running total
+        for year, count_unique in [(2014, 0), (2015, 1), (2016, 2), (2023, 3)]:
+            papers = randomise._annotate_count_unique(
+                RetractedPaper.objects.all(), year
+            )
+            self.assertEqual(papers.get().count_unique, count_unique)
+
+    def test_update_paper_summaries_incremental(self):
+        call_command("update_paper_summaries")
+        computed_at = RetractedPaperSummary.objects.get().computed_at
+
+        # Nothing changed, so the summary is left alone
+        call_command("update_paper_summaries")
+        self.assertEqual(RetractedPaperSummary.objects.get().computed_at, computed_at)
+
+        # A changed citing paper marks its retracted papers for summarising
+        citing_paper = self.citing_papers["3"]
+        citing_paper.cited_in_rct = True
+        citing_paper.save()
+        call_command("update_paper_summaries")
+        summary = RetractedPaperSummary.objects.get()
+        self.assertGreater(summary.computed_at, computed_at)
+        self.assertEqual(summary.count_unique_in_rct, 3)
+        self.assertEqual(summary.count_unique_after_rct, 0)
@@ -0,0 +1,45 @@
+from django.core.management import call_command
+from django.test import TestCase
+
+from common import setup
+from retractions.models import Author, AuthorAlias
+
+
+class CommandsTestCase(TestCase):
+    def setUp(self):
+        setup.setup_logger(2)
+
+    def test_validate_author_aliases(self):
+        author = Author.objects.create(auid="1")
+        for email_address in ["one@example.com", "notanemail", None, ""]:
+            AuthorAlias.objects.create(author=author, email_address=email_address)
+        # As if loaded before validation existed
+        AuthorAlias.objects.update(email_valid=None)
+
+        call_command("validate_author_aliases")
+        self.assertEqual(
+            dict(AuthorAlias.objects.values_list("email_address", "email_valid")),
+            {"one@example.com": True, "notanemail": False, None: None, "": None},
+        )
+
+        # Only unchecked aliases are validated, unless asked to recheck all
+        AuthorAlias.objects.filter(email_address="notanemail").update(email_valid=True)
+        call_command("validate_author_aliases")
+        self.assertTrue(AuthorAlias.objects.get(email_address="notanemail").email_valid)
+        call_command("validate_author_aliases", "--all")
+        self.assertFalse(
+            AuthorAlias.objects.get(email_address="notanemail").email_valid
+        )
+
+    def test_validate_author_aliases_counts(self):
+        """Only addresses anymail rejects are counted as invalid, and aliases
+        without an address aren't checked"""
+        author = Author.objects.create(auid="1")
+        for email_address in ["one@example.com", "notanemail", None, ""]:
+            AuthorAlias.objects.create(author=author, email_address=email_address)
+        AuthorAlias.objects.update(email_valid=None)
+
+        with self.assertLogs(level="INFO") as logs:
+            call_command("validate_author_aliases")
+        self.assertIn("Validating email addresses of 2 aliases", logs.output[0])
+        self.assertIn("Done, 1 invalid email addresses", logs.output[-1])
@@ -0,0 +1,67 @@
+import numpy
+from django.test import SimpleTestCase
+
+from retractions import allocation
+
+
+class AllocationTestCase(SimpleTestCase):
+    def test_allocate_balanced_within_strata(self):
+        strata = numpy.array([0, 0, 0, 0, 1, 1, 1, 2, 2, 2, 2, 2])
+        rngs = allocation.generators(numpy.random.SeedSequence(1), 1000)
+        allocations = allocation.allocate(strata, rngs, chunk_size=300)
+        self.assertEqual(allocations.shape, (1000, 12))
+        self.assertEqual(allocations.dtype, numpy.int8)
+        self.assertTrue(numpy.isin(allocations, [0, 1]).all())
+
+        # Even strata split exactly, odd ones are off by the middle paper
+        for stratum, (low, high) in {0: (2, 2), 1: (1, 2), 2: (2, 3)}.items():
+            intervention = allocations[:, strata == stratum].sum(axis=1)
+            self.assertTrue(((intervention >= low) & (intervention <= high)).all())
+            self.assertEqual(set(intervention), {low, high})
+
+        # Every paper is in either group about half the time
+        proportions = allocations.mean(axis=0)
+        self.assertTrue(((proportions > 0.4) & (proportions < 0.6)).all())
+
+    def test_allocate_reproducible(self):
+        strata = numpy.array([3, 1, 3, 1, 1])
+        first = allocation.allocate(
+            strata, allocation.generators(numpy.random.SeedSequence(42), 10)
+        )
+        second = allocation.allocate(
+            strata, allocation.generators(numpy.random.SeedSequence(42), 10)
+        )
+        self.assertTrue((first == second).all())
+
+    def test_allocate_independent_of_chunks(self):
+        """Each randomisation depends only on its own Generator, so can be
+        drawn separately"""
+        strata = numpy.array([3, 1, 3, 1, 1, 2, 2])
+        rngs = allocation.generators(numpy.random.SeedSequence(42), 10)
+        together = allocation.allocate(strata, rngs)
+        rngs = allocation.generators(numpy.random.SeedSequence(42), 10)
+        apart = numpy.concatenate(
+            [
+                allocation.allocate(strata, rngs[:3]),
+                allocation.allocate(strata, rngs[3:]),
+            ]
+        )
+        self.assertTrue((together == apart).all())
+
+    def test_allocate_parallel(self):
+        """Simulations are the same however many processes they are split
+        across"""
+        strata = numpy.array([3, 1, 3, 1, 1, 2, 2])
+        # As simulate does, with a child of the seed for each stratification
+        serial = allocation.allocate_parallel(
+            strata, numpy.random.SeedSequence(7).spawn(2)[1], 25, workers=1
+        )
+        parallel = allocation.allocate_parallel(
+            strata,
+            numpy.random.SeedSequence(7).spawn(2)[1],
+            25,
+            workers=2,
+            chunk_size=4,
+        )
+        self.assertEqual(parallel.shape, (25, 7))
+        self.assertTrue((serial == parallel).all())
@@ -0,0 +1,26 @@
+import pandas
+from django.test import TestCase
+
+from retractions import datasets
+from retractions.models import RetractedPaper
+
+
+class DatasetsTestCase(TestCase):
+    def test_values_frame(self):
+        """Streaming in chunks gives the same frame as loading the values,
+        even when a column is null throughout a chunk"""
+        for pmid, stratifying_group in [("1", None), ("2", None), ("3", 4)]:
+            RetractedPaper.objects.create(
+                pmid=pmid, stratifying_group=stratifying_group
+            )
+        papers = RetractedPaper.objects.order_by("pmid")
+
+        df = datasets.values_frame(papers, "pmid", "stratifying_group", chunk_size=2)
+        pandas.testing.assert_frame_equal(
+            df, pandas.DataFrame(papers.values("pmid", "stratifying_group"))
+        )
+
+    def test_values_frame_empty(self):
+        df = datasets.values_frame(RetractedPaper.objects.all(), "pmid")
+        self.assertEqual(list(df.columns), ["pmid"])
+        self.assertEqual(len(df), 0)
@@ -0,0 +1,65 @@
+import datetime
+from datetime import date
+
+from django.test import SimpleTestCase
+
+from retractions.dates import parse_medline_date, parse_text_date
+
+
+def strptime_text_date(t):
+    """The strptime cascade previously used for Scopus date-text fields"""
+    for fmt in ["%d %B %Y", "%B %Y", "%Y", "%B %d, %Y", "%b-%Y"]:
+        try:
+            return datetime.datetime.strptime(t, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+class TextDatesTestCase(SimpleTestCase):
+    def test_parse_text_date(self):
+        for s, expected in [
+            ("22 September 1983", {"date": date(1983, 9, 22), "granularity": "d"}),
+            ("September 1983", {"date": date(1983, 9, 1), "granularity": "m"}),
+            ("1983", {"date": date(1983, 1, 1), "granularity": "y"}),
+            ("September 22, 1983", {"date": date(1983, 9, 22), "granularity": "d"}),
+            ("Sep-1983", {"date": date(1983, 9, 1), "granularity": "m"}),
+            ("1983 Sep", {"date": None, "granularity": None}),
+            ("31 February 1983", {"date": None, "granularity": None}),
+        ]:
+            self.assertEqual(parse_text_date(s), expected)
+
+    def test_parse_text_date_matches_strptime(self):
+        for s in [
+            "1 january 2001",
+            "01 JANUARY 2001",
+            "9  March   2014",
+            "May 2014",
+            "Sept 2014",
+            "Mar 2014",
+            "March-2014",
+            "mar-2014",
+            "March 3,2014",
+            "March 3, 2014",
+            " 2014",
+            "0000",
+            "32 March 2014",
+            "0 March 2014",
+            "29 February 2016",
+            "29 February 2015",
+            "",
+        ]:
+            self.assertEqual(parse_text_date(s)["date"], strptime_text_date(s), s)
+
+    def test_parse_medline_date(self):
+        self.assertEqual(
+            parse_medline_date("2007 Aug 9-Sep 12"),
+            {"date": date(2007, 8, 9), "granularity": "d"},
+        )
+        self.assertEqual(
+            parse_medline_date("Spring 2016"),
+            {"date": date(2016, 4, 1), "granularity": "m"},
+        )
+        self.assertEqual(
+            parse_medline_date("2016 Spring"), {"date": None, "granularity": None}
+        )
@@ -0,0 +1,86 @@
+import email.message
+import tempfile
+
+from django.core.mail import EmailMessage
+from django.test import SimpleTestCase
+
+from retractions import mail_archive
+
+
+def message(to, subject):
+    msg = email.message.EmailMessage()
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg["Message-ID"] = f"<{subject}@retracted.net>"
+    msg.set_content("Body")
+    return msg
+
+
+class MailArchiveTestCase(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.archive = mail_archive.MailArchive(tmp.name)
+
+    def test_add_and_get(self):
+        self.archive.add(message("tofu@beans.com", "one"), message_id="<1.mg>")
+        self.archive.add(message("beans@tofu.com", "two"))
+
+        self.assertEqual(self.archive.get("1.mg")["Subject"], "one")
+        self.assertEqual(self.archive.get("<1.mg>")["Subject"], "one")
+        self.assertEqual(self.archive.get("two@retracted.net")["Subject"], "two")
+        self.assertIsNone(self.archive.get("3.mg"))
+
+    def test_entries(self):
+        self.archive.add(message("tofu@beans.com", "one"), message_id="1.mg", auid="1")
+        self.archive.add(message("beans@tofu.com", "two"), message_id="2.mg", auid="2")
+        self.archive.add(
+            message("tofu@beans.com", "three"), message_id="3.mg", auid="1"
+        )
+
+        self.assertEqual(
+            [entry["message_id"] for entry in self.archive.entries()],
+            ["1.mg", "2.mg", "3.mg"],
+        )
+        self.assertEqual(
+            [entry["subject"] for entry in self.archive.entries(auid="1")],
+            ["one", "three"],
+        )
+        self.assertEqual(
+            [entry["to"] for entry in self.archive.entries(message_id="<2.mg>")],
+            ["beans@tofu.com"],
+        )
+
+    def test_entries_indexed(self):
+        """Entries by message id or AUID are read without the whole index"""
+        self.archive.add(message("tofu@beans.com", "one"), message_id="1.mg", auid="1")
+        self.archive.add(message("beans@tofu.com", "two"), message_id="2.mg", auid="2")
+        self.archive.index_path.unlink()
+
+        self.assertEqual(
+            [entry["subject"] for entry in self.archive.entries(auid="2")], ["two"]
+        )
+        self.assertEqual(
+            [entry["auid"] for entry in self.archive.entries(message_id="1.mg")],
+            ["1"],
+        )
+        self.assertEqual(list(self.archive.entries(auid="3")), [])
+
+    def test_folded_subject(self):
+        subject = (
+            "RetractoBot: You cited a retracted paper in your Frontiers in Tofu "
+            "paper published in 2018, Séverine"
+        )
+        msg = EmailMessage(subject=subject, body="Body", to=["tofu@beans.com"])
+        self.assertIn("\n", str(msg.message()["Subject"]))
+        self.archive.add(msg.message(), message_id="1.mg")
+
+        (entry,) = self.archive.entries()
+        self.assertEqual(entry["subject"], subject)
+
+    def test_clear(self):
+        self.archive.add(message("tofu@beans.com", "one"), message_id="1.mg")
+        self.archive.clear()
+
+        self.assertEqual(list(self.archive.entries()), [])
+        self.assertIsNone(self.archive.get("1.mg"))
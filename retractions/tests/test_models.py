@@ -1,6 +1,12 @@
 from django.test import TestCase
 
-from retractions.models import CitationRetractionPair, CitingPaper, RetractedPaper
+from retractions.models import (
+    Author,
+    AuthorAlias,
+    CitationRetractionPair,
+    CitingPaper,
+    RetractedPaper,
+)
 
 
 class ModelsTestCase(TestCase):
@@ -41,3 +47,17 @@ class ModelsTestCase(TestCase):
         citing_paper = CitingPaper.objects.create(scopus_id="456")
         citing_paper.retraction_flagged = CitingPaper.FlaggedLocation.NEITHER
         self.assertEqual(citing_paper.retraction_flagged.label, "Neither")
+
+    def test_author_alias_email_valid(self):
+        """
+        Test that saving an alias records whether its email address is valid
+        """
+        author = Author.objects.create(auid="1")
+        alias = AuthorAlias.objects.create(author=author, email_address="a@b.com")
+        self.assertTrue(alias.email_valid)
+        alias.email_address = "notanemail"
+        alias.save()
+        self.assertFalse(alias.email_valid)
+        alias.email_address = None
+        alias.save()
+        self.assertIsNone(alias.email_valid)
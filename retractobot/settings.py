@@ -24,6 +24,15 @@ INSTALLED_APPS = [
     "retractions",
 ]
 
+# Email templates, from retractions/templates. Django wraps the loaders in the
+# cached loader, so each template is compiled once per process
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "APP_DIRS": True,
+    },
+]
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases